@@ -1,8 +1,16 @@
 from fastapi.security import OAuth2AuthorizationCodeBearer
-from keycloak import KeycloakOpenID  # pip require python-keycloak
+from jwcrypto import jwk
+from jwcrypto.jws import InvalidJWSSignature
+from app.cache import get_cache
 from app.config import config
 from app.models.user import User
-from fastapi import HTTPException, Security, Depends, status
+from app.tracing import span
+from fastapi import HTTPException, Request, Security, Depends, status
+from functools import lru_cache
+import asyncio
+import hashlib
+import httpx
+import time
 
 # This is used for fastapi docs authentification
 oauth2_scheme = OAuth2AuthorizationCodeBearer(
@@ -13,34 +21,114 @@ oauth2_scheme = OAuth2AuthorizationCodeBearer(
     ),
 )
 
-keycloak_openid = KeycloakOpenID(
-    server_url=config.KEYCLOAK_URL,
-    client_id=config.KEYCLOAK_BFF_ID,
-    client_secret_key=config.KEYCLOAK_BFF_SECRET,
-    realm_name=config.KEYCLOAK_REALM,
-    verify=True,
-)
 
+@lru_cache()
+def get_keycloak_openid():
+    """The Keycloak client of the BFF, created on first use"""
+
+    from keycloak import KeycloakOpenID  # pip require python-keycloak
 
-async def get_idp_public_key():
-    return (
-        "-----BEGIN PUBLIC KEY-----\n"
-        f"{keycloak_openid.public_key()}"
-        "\n-----END PUBLIC KEY-----"
+    return KeycloakOpenID(
+        server_url=config.KEYCLOAK_URL,
+        client_id=config.KEYCLOAK_BFF_ID,
+        client_secret_key=config.KEYCLOAK_BFF_SECRET,
+        realm_name=config.KEYCLOAK_REALM,
+        verify=True,
     )
 
 
+# Realm public key used to validate tokens, and when it was last fetched
+_public_key: jwk.JWK | None = None
+_public_key_fetched: float = 0.0
+_public_key_lock = asyncio.Lock()
+
+
+async def get_idp_public_key(
+    client: httpx.AsyncClient,
+    refresh: bool = False,
+) -> jwk.JWK:
+    """Get the realm public key, fetching it asynchronously when stale
+
+    The key is cached for config.PUBLIC_KEY_CACHE_SECONDS so validating a
+    token does not need a request to Keycloak. With `refresh`, eg: after the
+    realm keys were rotated, it is fetched again unless it is younger than
+    config.PUBLIC_KEY_REFRESH_SECONDS, so bad tokens cannot flood Keycloak.
+    """
+
+    global _public_key, _public_key_fetched
+
+    async with _public_key_lock:
+        age = time.monotonic() - _public_key_fetched
+        if (
+            _public_key is None
+            or (refresh and age > config.PUBLIC_KEY_REFRESH_SECONDS)
+            or age > config.PUBLIC_KEY_CACHE_SECONDS
+        ):
+            res = await client.get(
+                f"{config.KEYCLOAK_URL}/realms/{config.KEYCLOAK_REALM}"
+            )
+            res.raise_for_status()
+            _public_key = jwk.JWK.from_pem(
+                (
+                    "-----BEGIN PUBLIC KEY-----\n"
+                    f"{res.json()['public_key']}"
+                    "\n-----END PUBLIC KEY-----"
+                ).encode("utf-8")
+            )
+            _public_key_fetched = time.monotonic()
+
+    return _public_key
+
+
 # Get the payload/token from keycloak
-async def get_payload(token: str = Security(oauth2_scheme)) -> dict:
-    try:
-        return keycloak_openid.decode_token(token)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=str(e),  # "Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
+async def get_payload(
+    request: Request,
+    token: str = Security(oauth2_scheme),
+) -> dict:
+    # Tokens already validated by any worker are cached until they expire,
+    # keyed by their hash so that only the exact same token matches
+    cache = get_cache()
+    cache_key = f"auth:token:{hashlib.sha256(token.encode()).hexdigest()}"
+    with span("auth.get_payload") as s:
+        payload = await cache.get_json(cache_key)
+        if s is not None:
+            s.set("auth.cached", payload is not None)
+        if payload is not None:
+            return payload
+
+        try:
+            # Validation with a given key is CPU bound only, with no I/O
+            key = await get_idp_public_key(request.state.client)
+            try:
+                payload = get_keycloak_openid().decode_token(token, key=key)
+            except InvalidJWSSignature:
+                # Signed with a new key if the realm keys were rotated
+                new_key = await get_idp_public_key(
+                    request.state.client, refresh=True
+                )
+                if new_key is key:
+                    raise
+                payload = get_keycloak_openid().decode_token(
+                    token, key=new_key
+                )
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=str(e),  # "Invalid authentication credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        await cache.set_json(
+            cache_key,
+            payload,
+            ttl=min(
+                payload.get("exp", 0) - time.time(),
+                config.AUTH_CACHE_SECONDS,
+            ),
         )
 
+    return payload
+
 
 # Get user infos from the payload
 async def get_user_info(payload: dict = Depends(get_payload)) -> User:
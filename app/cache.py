@@ -0,0 +1,228 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Hashable
+from app.config import config
+import asyncio
+import json
+import logging
+import orjson
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """A bounded in-process cache with a per-entry time to live
+
+    Entries are evicted least recently used first once maxsize is reached.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class CacheBackend(ABC):
+    """Cache for auth results, the role index and proxied responses
+
+    Values are bytes so that every backend behaves the same. Invalidating
+    keys deletes them and publishes them to every worker sharing the
+    backend, so that local copies are dropped too.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None: ...
+
+    @abstractmethod
+    async def publish(self, keys: list[str]) -> None: ...
+
+    async def invalidate(self, *keys: str) -> None:
+        await self.delete(*keys)
+        await self.publish(list(keys))
+
+    async def get_json(self, key: str) -> Any:
+        value = await self.get(key)
+        return orjson.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: float) -> None:
+        await self.set(key, orjson.dumps(value), ttl)
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU backend, private to each worker"""
+
+    def __init__(self, maxsize: int):
+        self._cache = TTLCache(maxsize=maxsize)
+
+    async def get(self, key: str) -> bytes | None:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._cache.set(key, value, ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._cache.delete(key)
+
+    async def publish(self, keys: list[str]) -> None:
+        pass  # No other worker holds copies
+
+
+class RedisCache(CacheBackend):
+    """Backend shared by all workers and replicas through Redis
+
+    Values read from Redis are kept for config.CACHE_NEAR_SECONDS in a local
+    LRU, which invalidations published on the channel clear in every
+    worker. Any redis.asyncio compatible client can be given instead of a
+    URL (eg: fakeredis).
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        *,
+        client: Any = None,
+        channel: str = "bff:invalidate",
+        near_maxsize: int = 1024,
+        near_ttl: float = 5,
+    ):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError(
+                    "CACHE_URL requires redis, install the 'redis' extra"
+                )
+            client = redis.from_url(url)
+
+        self._redis = client
+        self._channel = channel
+        self._near = TTLCache(maxsize=near_maxsize)
+        self._near_ttl = near_ttl
+        self._listener: asyncio.Task | None = None
+
+    # The cache is an optimisation: Redis errors are logged, not raised
+
+    async def get(self, key: str) -> bytes | None:
+        value = self._near.get(key)
+        if value is None:
+            try:
+                value = await self._redis.get(key)
+            except Exception as e:
+                logger.warning(f"Cache get failed: {e!r}")
+                return None
+            if value is not None:
+                self._near.set(key, value, self._near_ttl)
+
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        if ttl <= 0:
+            return
+
+        self._near.set(key, value, min(ttl, self._near_ttl))
+        try:
+            await self._redis.set(key, value, px=int(ttl * 1000))
+        except Exception as e:
+            logger.warning(f"Cache set failed: {e!r}")
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._near.delete(key)
+        try:
+            await self._redis.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Cache delete failed: {e!r}")
+
+    async def publish(self, keys: list[str]) -> None:
+        try:
+            await self._redis.publish(self._channel, json.dumps(keys))
+        except Exception as e:
+            logger.warning(f"Cache invalidation publish failed: {e!r}")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self._channel)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        keys = json.loads(message["data"])
+                        for key in keys:
+                            self._near.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Entries may be stale while disconnected, drop them all
+                logger.warning(f"Cache invalidation listener failed: {e!r}")
+                self._near.clear()
+                await asyncio.sleep(1)
+
+    async def start(self) -> None:
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        await self._redis.aclose()
+
+
+@lru_cache()
+def get_cache() -> CacheBackend:
+    """The cache backend, shared through Redis when CACHE_URL is set"""
+
+    if config.CACHE_URL:
+        return RedisCache(
+            config.CACHE_URL,
+            near_maxsize=config.CACHE_MAX_ENTRIES,
+            near_ttl=config.CACHE_NEAR_SECONDS,
+        )
+
+    return MemoryCache(maxsize=config.CACHE_MAX_ENTRIES)
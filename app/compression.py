@@ -0,0 +1,194 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.metrics import metrics
+import zlib
+
+try:
+    import brotli  # Optional, install the 'brotli' extra
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    """Encodings of an Accept-Encoding header, except those with q=0"""
+
+    encodings = set()
+    for part in accept_encoding.lower().split(","):
+        encoding, _, params = part.partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        encodings.add(encoding.strip())
+
+    return encodings
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        # Flush so each chunk reaches the client as soon as it arrives
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """Compress responses with brotli or gzip, negotiated by Accept-Encoding
+
+    Only responses of a compressible content type, larger than minimum_size
+    and not already encoded (eg: compressed by the API) are compressed.
+    Bodies are compressed chunk by chunk as they are streamed, buffering at
+    most minimum_size bytes to decide whether the response is large enough.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        minimum_size: int = 1024,
+        compressible_types: list[str] | None = None,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compressible_types = tuple(
+            compressible_types or ["application/json", "text/"]
+        )
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = _accepted_encodings(
+            Headers(scope=scope).get("accept-encoding", "")
+        )
+        if brotli is not None and "br" in accepted:
+            responder = _CompressionResponder(
+                self, send, "br", lambda: _BrotliEncoder(self.brotli_quality)
+            )
+        elif "gzip" in accepted:
+            responder = _CompressionResponder(
+                self, send, "gzip", lambda: _GzipEncoder(self.gzip_level)
+            )
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware, send: Send, encoding: str, encoder):
+        self.middleware = middleware
+        self.send = send
+        self.encoding = encoding
+        self.create_encoder = encoder
+        self.start: Message | None = None
+        self.buffer: list[bytes] = []
+        self.buffered = 0
+        self.encoder = None
+        self.passthrough = False
+
+    def _compressible(self, message: Message) -> bool:
+        headers = Headers(raw=message["headers"])
+        content_length = headers.get("content-length")
+
+        return (
+            message["status"] not in (204, 304)
+            and "content-encoding" not in headers
+            and headers.get("content-type", "")
+            .lower()
+            .startswith(self.middleware.compressible_types)
+            and (
+                content_length is None
+                or int(content_length) >= self.middleware.minimum_size
+            )
+        )
+
+    async def _start_compressing(self, more_body: bool) -> None:
+        headers = MutableHeaders(raw=self.start["headers"])
+        del headers["content-length"]
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        await self.send(self.start)
+
+        self.encoder = self.create_encoder()
+        body = b"".join(self.buffer)
+        self.buffer.clear()
+        await self._send_compressed(body, more_body)
+
+    async def _send_compressed(self, body: bytes, more_body: bool) -> None:
+        compressed = self.encoder.compress(body) if body else b""
+        if not more_body:
+            compressed += self.encoder.finish()
+
+        metrics.incr("compression.bytes_in", len(body))
+        metrics.incr("compression.bytes_out", len(compressed))
+        await self.send(
+            {
+                "type": "http.response.body",
+                "body": compressed,
+                "more_body": more_body,
+            }
+        )
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            if self._compressible(message):
+                self.start = message  # Held until the size is known
+            else:
+                self.passthrough = True
+                await self.send(message)
+            return
+
+        if self.passthrough or message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is not None:
+            await self._send_compressed(body, more_body)
+            return
+
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if self.buffered >= self.middleware.minimum_size:
+            metrics.incr(f"compression.responses.{self.encoding}")
+            await self._start_compressing(more_body)
+        elif not more_body:
+            # The whole body is below the threshold, send it as it is
+            self.passthrough = True
+            await self.send(self.start)
+            await self.send(
+                {
+                    "type": "http.response.body",
+                    "body": b"".join(self.buffer),
+                    "more_body": False,
+                }
+            )
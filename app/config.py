@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from app.models.route import RouteSettings
 import httpx
 
 
@@ -19,9 +20,39 @@ class Config(BaseSettings):
 
     # ECEO-API settings
     DEEPREEFMAP_API_URL: str  # Path to API (eg: http://deepreefmap-api-dev)
+    UPSTREAM_PREFIX: str = "/v1"
+
+    # Per-route proxy settings, keyed by "METHOD /path" (without API_PREFIX)
+    ROUTE_SETTINGS: dict[str, RouteSettings] = {
+        "GET /submissions": RouteSettings(cacheable=True, projection="bff"),
+        "GET /submissions/{submission_id}": RouteSettings(
+            cacheable=True, projection="bff"
+        ),
+        "GET /objects": RouteSettings(cacheable=True, projection="bff"),
+        "GET /objects/{object_id}": RouteSettings(
+            cacheable=True, projection="bff"
+        ),
+        "GET /transects": RouteSettings(cacheable=True, projection="bff"),
+        "GET /transects/{transect_id}": RouteSettings(
+            cacheable=True, projection="bff"
+        ),
+        "GET /status": RouteSettings(cacheable=True, timeout=10.0),
+        "PATCH /objects": RouteSettings(  # Upload chunks
+            timeout=60.0, long_transfer=True, invalidates=[]
+        ),
+        "POST /objects/{object_id}": RouteSettings(timeout=30.0),
+        "POST /transects/batch": RouteSettings(timeout=30.0),
+    }
 
     SERIALIZER_SECRET_KEY: str
     SERIALIZER_EXPIRY_HOURS: int = 6
+    DOWNLOAD_TOKEN_CACHE_SIZE: int = 1024  # Verified download tokens
+    AUTHZ_CACHE_SECONDS: int = 30
+    # The bundle token lists the files and is sent in the URL, which servers
+    # and proxies limit to a few kB
+    BUNDLE_MAX_FILES: int = 100
+    BUNDLE_MAX_FILENAMES_LENGTH: int = 3000  # Characters, all names together
+    BUNDLE_BUFFER_CHUNKS: int = 16  # Chunks buffered per file being fetched
 
     TIMEOUT: httpx.Timeout = httpx.Timeout(
         5.0,
@@ -32,6 +63,67 @@ class Config(BaseSettings):
     )
 
     VALID_ROLES: list[str] = ["admin", "user"]
+    USER_EXPORT_PAGE_SIZE: int = 500  # Users fetched per Keycloak request
+
+    # Cache shared by workers through Redis (eg: redis://cache:6379/0) if
+    # set, otherwise each worker keeps its own in-process LRU cache
+    CACHE_URL: str | None = None
+    CACHE_MAX_ENTRIES: int = 10000  # In-process entries, per worker
+    CACHE_NEAR_SECONDS: float = 5  # Local copies of entries read from Redis
+    AUTH_CACHE_SECONDS: int = 300  # Validated tokens, at most until expiry
+    ROLE_INDEX_CACHE_SECONDS: int = 60  # Members of the admin/user roles
+    RESPONSE_CACHE_SECONDS: int = 5  # Responses of cacheable routes
+    RESPONSE_CACHE_MAX_BYTES: int = 256 * 1024
+
+    # Responses are compressed when larger than the minimum size and of a
+    # content type starting with one of the compressible types
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    COMPRESSIBLE_TYPES: list[str] = [
+        "application/json",
+        "application/geo+json",
+        "application/x-ndjson",
+        "text/",
+    ]
+    GZIP_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4  # Used if brotli is installed
+
+    # Chunked uploads are hashed as they are relayed, in a thread for chunk
+    # pieces larger than UPLOAD_HASH_THREAD_BYTES
+    UPLOAD_DIGEST_ALGORITHM: str = "sha256"
+    UPLOAD_SESSION_CACHE_SIZE: int = 1024  # Uploads in progress, per worker
+    UPLOAD_SESSION_SECONDS: int = 24 * 60 * 60  # Since the last chunk
+    UPLOAD_HASH_THREAD_BYTES: int = 256 * 1024
+
+    # Seconds given to downloads and uploads in flight to finish when the
+    # worker is drained, before they are aborted
+    DRAIN_TIMEOUT_SECONDS: float = 25.0
+    DRAIN_TOKEN: str | None = None  # Bearer token for POST /drain, if set
+    METRICS_TOKEN: str | None = None  # Bearer token for GET /metrics, if set
+
+    # Keycloak and API connections are prepared before serving requests
+    WARMUP_TIMEOUT_SECONDS: float = 10.0
+    WARMUP_CONNECTIONS: int = 4  # Pooled connections opened to the API
+
+    PUBLIC_KEY_CACHE_SECONDS: int = 3600  # Realm public key for tokens
+    PUBLIC_KEY_REFRESH_SECONDS: int = 30  # Least time between key rotations
+    BLOCKING_EXECUTOR_THREADS: int = 8  # For blocking Keycloak admin calls
+
+    # Traces are exported to an OpenTelemetry collector with OTLP/HTTP (eg:
+    # http://collector:4318) if set, or else appended to TRACE_FILE if set.
+    # Requests are sampled at TRACE_SAMPLE_RATE, continuing the trace of
+    # their traceparent if any. Its sampled flag is only followed with
+    # TRACE_TRUST_PARENT, when the BFF is only reached through a trusted
+    # proxy, as clients could otherwise have any request traced.
+    TRACE_OTLP_URL: str | None = None
+    TRACE_FILE: str | None = None  # JSON lines, eg: /tmp/traces.jsonl
+    TRACE_SAMPLE_RATE: float = 0.1
+    TRACE_TRUST_PARENT: bool = False
+    TRACE_EXPORT_SECONDS: float = 5.0
+    TRACE_SERVICE: str = "deepreefmap-bff"
+
+    # Logs event loop callbacks taking longer than SLOW_CALLBACK_SECONDS
+    DEBUG: bool = False
+    SLOW_CALLBACK_SECONDS: float = 0.1
 
 
 @lru_cache()
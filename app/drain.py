@@ -0,0 +1,118 @@
+from pathlib import Path
+from typing import AsyncIterator, TypeVar
+from fastapi import HTTPException, status
+from app.metrics import metrics
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StreamAborted(Exception):
+    pass
+
+
+class StreamTracker:
+    """Long-lived transfers in flight, drained before the worker stops
+
+    While draining, new long transfers are refused and those in flight are
+    given until a deadline to finish. Streams still running then are
+    aborted on their next chunk, failing the transfer instead of silently
+    truncating it.
+
+    Workers of the same server share the draining state through the `flag`
+    file, so that draining any of them drains them all.
+    """
+
+    def __init__(self, flag: Path | None = None):
+        self.active = 0
+        self.draining = False
+        self.drained = 0  # Finished while draining
+        self.aborted = 0  # Cut at the deadline
+        self._aborting = False
+        self._flag = flag
+        self._stale = self._touched()  # Left by an earlier run, if any
+
+    def reject_if_draining(self) -> None:
+        if self.draining:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The server is shutting down, retry shortly",
+                headers={"Retry-After": "5"},
+            )
+
+    async def track(self, chunks: AsyncIterator[T]) -> AsyncIterator[T]:
+        """Relay the chunks of a stream, counting it as active meanwhile"""
+
+        self.active += 1
+        metrics.set("streams.active", self.active)
+        try:
+            async for chunk in chunks:
+                if self._aborting:
+                    raise StreamAborted("Stream aborted on shutdown")
+                yield chunk
+        finally:
+            self.active -= 1
+            metrics.set("streams.active", self.active)
+            if self.draining and not self._aborting:
+                self.drained += 1
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    def _touched(self) -> int | None:
+        if self._flag is None:
+            return None
+        try:
+            return self._flag.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _flagged(self) -> bool:
+        touched = self._touched()
+        return touched is not None and touched != self._stale
+
+    async def watch(self, timeout: float, interval: float = 0.5) -> None:
+        """Drain this worker too once another one of the server is drained"""
+
+        while not self.draining:
+            if self._flagged():
+                await self.drain(timeout)
+                return
+            await asyncio.sleep(interval)
+
+    async def drain(self, timeout: float) -> dict[str, int]:
+        """Refuse new transfers and wait for those in flight to finish"""
+
+        if not self.draining:
+            logger.info(f"Draining {self.active} streams")
+            self.draining = True
+            if self._flag is not None and not self._flagged():
+                self._flag.touch()  # Have the other workers drain as well
+
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        if self.active and not self._aborting:
+            logger.warning(f"Aborting {self.active} streams after {timeout}s")
+            self._aborting = True
+            self.aborted += self.active
+
+        metrics.set("streams.drained", self.drained)
+        metrics.set("streams.aborted", self.aborted)
+        logger.info(
+            f"Drained {self.drained} streams, aborted {self.aborted} streams"
+        )
+
+        return {"drained": self.drained, "aborted": self.aborted}
+
+
+# Named after the process managing the workers, shared by all of them
+streams = StreamTracker(
+    Path(tempfile.gettempdir()) / f"deepreefmap-bff-{os.getppid()}.draining"
+)
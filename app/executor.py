@@ -0,0 +1,57 @@
+from typing import Any, Callable, TypeVar
+from anyio import CapacityLimiter, to_thread
+from app.config import config
+from app.metrics import metrics
+from app.tracing import span
+import time
+
+T = TypeVar("T")
+
+# Bounds the threads used for blocking calls (eg: the python-keycloak
+# client), separately from anyio's default limiter used by FastAPI for sync
+# endpoints and dependencies. Created on first use, as it needs a loop.
+_limiter: CapacityLimiter | None = None
+
+
+def get_limiter() -> CapacityLimiter:
+    global _limiter
+
+    if _limiter is None:
+        _limiter = CapacityLimiter(config.BLOCKING_EXECUTOR_THREADS)
+
+    return _limiter
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call in the bounded executor, off the event loop
+
+    Time spent queueing for a thread and running the call is recorded in
+    the executor.* metrics, which are only updated from the event loop.
+    """
+
+    started = None
+
+    def call() -> T:
+        nonlocal started
+        started = time.perf_counter()
+        return func(*args, **kwargs)
+
+    submitted = time.perf_counter()
+    metrics.incr("executor.in_flight")
+    with span(f"blocking {getattr(func, '__qualname__', func)}") as s:
+        try:
+            result = await to_thread.run_sync(call, limiter=get_limiter())
+        except Exception:
+            metrics.incr("executor.failed")
+            raise
+        finally:
+            finished = time.perf_counter()
+            metrics.decr("executor.in_flight")
+            if started is not None:
+                metrics.incr("executor.completed")
+                metrics.incr("executor.wait_seconds", started - submitted)
+                metrics.incr("executor.run_seconds", finished - started)
+                if s is not None:
+                    s.set("executor.wait_seconds", started - submitted)
+
+    return result
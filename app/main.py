@@ -1,4 +1,10 @@
-from fastapi import FastAPI, status
+import time
+
+# Imports of the app and its routers are timed, as part of the cold start
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import config
 from app.models.config import KeycloakConfig
@@ -10,8 +16,13 @@ from app.submission_job_logs import router as submission_job_logs_router
 from app.transects import router as transects_router
 from app.status import router as status_router
 from app.utils import lifespan
+from app.compression import CompressionMiddleware
+from app.metrics import metrics
+from app.drain import streams
+from app.tracing import TracingMiddleware
+import hmac
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 origins = ["*"]
@@ -23,15 +34,31 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=config.COMPRESSION_MINIMUM_SIZE,
+    compressible_types=config.COMPRESSIBLE_TYPES,
+    gzip_level=config.GZIP_LEVEL,
+    brotli_quality=config.BROTLI_QUALITY,
+)
+app.add_middleware(TracingMiddleware)  # Outermost, to time the whole request
 
 
-@app.get(f"{config.API_PREFIX}/config/keycloak")
-async def get_keycloak_config() -> KeycloakConfig:
-    return KeycloakConfig(
+# Static for the lifetime of the process, so serialised only once
+KEYCLOAK_CONFIG = (
+    KeycloakConfig(
         clientId=config.KEYCLOAK_CLIENT_ID,
         realm=config.KEYCLOAK_REALM,
         url=config.KEYCLOAK_URL,
     )
+    .model_dump_json()
+    .encode("utf-8")
+)
+
+
+@app.get(f"{config.API_PREFIX}/config/keycloak", response_model=KeycloakConfig)
+async def get_keycloak_config() -> Response:
+    return Response(KEYCLOAK_CONFIG, media_type="application/json")
 
 
 @app.get(
@@ -45,11 +72,69 @@ async def get_keycloak_config() -> KeycloakConfig:
 def get_health() -> HealthCheck:
     """Perform a Health Check
 
-    Useful for Kubernetes to check liveness and readiness probes
+    Useful for Kubernetes to check liveness probes, see /readyz for readiness
+    """
+    return HealthCheck(status="OK")
+
+
+@app.get(
+    "/readyz",
+    tags=["healthcheck"],
+    summary="Perform a Readiness Check",
+    response_description="Return HTTP Status Code 200 (OK)",
+    status_code=status.HTTP_200_OK,
+    response_model=HealthCheck,
+)
+def get_readiness(response: Response) -> HealthCheck:
+    """Perform a Readiness Check
+
+    Useful for Kubernetes readiness probes. Fails with 503 once the worker
+    is draining, to take it out of the load balancer while it stays alive.
     """
+    if streams.draining:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return HealthCheck(status="DRAINING")
     return HealthCheck(status="OK")
 
 
+def check_bearer_token(request: Request, token: str | None) -> None:
+    """Check the request is authenticated by the token, if one is set"""
+
+    authorization = request.headers.get("authorization", "").encode()
+    if token is None or not hmac.compare_digest(
+        authorization, f"Bearer {token}".encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorised to perform this operation",
+        )
+
+
+@app.post("/drain", tags=["healthcheck"])
+async def drain(request: Request) -> dict[str, int]:
+    """Stop accepting long transfers and wait for those in flight
+
+    Returns once they have all finished, or were aborted at the deadline.
+    Meant for a Kubernetes preStop hook, authenticated by the bearer token
+    in config.DRAIN_TOKEN, and disabled without one.
+    """
+
+    check_bearer_token(request, config.DRAIN_TOKEN)
+    return await streams.drain(config.DRAIN_TIMEOUT_SECONDS)
+
+
+@app.get("/metrics", tags=["healthcheck"])
+async def get_metrics(request: Request) -> dict[str, float]:
+    """Get the metrics of this worker process
+
+    Authenticated by the bearer token in config.METRICS_TOKEN, and disabled
+    without one, as the counters reveal the traffic of the service.
+    """
+
+    check_bearer_token(request, config.METRICS_TOKEN)
+    return metrics.snapshot()
+
+
 app.include_router(
     submissions_router,
     prefix=f"{config.API_PREFIX}/submissions",
@@ -80,3 +165,5 @@ app.include_router(
     prefix=f"{config.API_PREFIX}/status",
     tags=["status"],
 )
+
+metrics.set("startup.import_seconds", time.perf_counter() - IMPORT_STARTED)
@@ -0,0 +1,29 @@
+from collections import defaultdict
+
+
+class Metrics:
+    """In-process counters and gauges, reported by the /metrics endpoint
+
+    Values are per worker process.
+    """
+
+    def __init__(self):
+        self._values: defaultdict[str, float] = defaultdict(float)
+
+    def incr(self, name: str, value: float = 1) -> None:
+        self._values[name] += value
+
+    def decr(self, name: str, value: float = 1) -> None:
+        self._values[name] -= value
+
+    def set(self, name: str, value: float) -> None:
+        self._values[name] = value
+
+    def get(self, name: str) -> float:
+        return self._values.get(name, 0)
+
+    def snapshot(self) -> dict[str, float]:
+        return dict(sorted(self._values.items()))
+
+
+metrics = Metrics()
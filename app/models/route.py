@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import Literal
+
+
+class RouteSettings(BaseModel):
+    """Proxy settings for a BFF route, keyed by "METHOD /path" in config
+
+    The path is the BFF route template without the API prefix, eg:
+    "GET /submissions/{submission_id}". Unset fields fall back to defaults
+    when the route table is compiled at startup.
+    """
+
+    upstream: str | None = None  # Upstream template, without the prefix
+    cacheable: bool = False
+    idempotent: bool | None = None  # Defaults to the HTTP method semantics
+    timeout: float | None = None  # Seconds, defaults to config.TIMEOUT
+    streaming: bool = True
+    long_transfer: bool = False  # Refused while draining, eg: uploads
+    # Collections whose cached responses are dropped by a write to the
+    # route, defaults to its own, eg: "submissions" for /submissions/{id}
+    invalidates: list[str] | None = None
+    # Applies `fields=` projections in the BFF, or passes them to the API
+    projection: Literal["bff", "upstream"] | None = None
@@ -1,5 +1,54 @@
-from pydantic import BaseModel
+from typing import Annotated
+from pydantic import AfterValidator, BaseModel, Field, field_validator
+from app.config import config
+
+
+def check_filename(filename: str) -> str:
+    """Reject names that are not a single path segment, eg: "../other/x"
+
+    Filenames are appended to the submission's upstream path, so they must
+    not escape it.
+    """
+
+    if (
+        filename in ("", ".", "..")
+        or "/" in filename
+        or "\\" in filename
+        or any(ord(char) < 32 or ord(char) == 127 for char in filename)
+    ):
+        raise ValueError("Invalid filename")
+    return filename
+
+
+Filename = Annotated[str, AfterValidator(check_filename)]
 
 
 class DownloadToken(BaseModel):
     token: str
+
+
+class DownloadTokensRequest(BaseModel):
+    filenames: list[Filename] = Field(
+        min_length=1, max_length=config.BUNDLE_MAX_FILES
+    )
+
+    @field_validator("filenames")
+    @classmethod
+    def check_length(cls, filenames: list[str]) -> list[str]:
+        if sum(map(len, filenames)) > config.BUNDLE_MAX_FILENAMES_LENGTH:
+            raise ValueError(
+                "Filenames are too long to be bundled, request fewer files"
+            )
+        return filenames
+
+
+class FileDownloadToken(BaseModel):
+    filename: str
+    token: str
+
+
+class DownloadTokens(BaseModel):
+    """Tokens for each file, and one to download them all as a ZIP bundle"""
+
+    tokens: list[FileDownloadToken]
+    bundle: str
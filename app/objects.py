@@ -1,7 +1,7 @@
 from typing import Any
 from fastapi import Depends, APIRouter, Query
-from app.utils import get_async_client, _reverse_proxy
-import httpx
+from app.utils import _reverse_proxy, proxy_request
+from app.uploads import ChunkHasher
 from uuid import UUID
 from app.models.user import User
 from app.auth import get_user_info
@@ -44,17 +44,28 @@ async def upload_file(
 async def upload_chunk(
     request: Request,
     patch: str = Query(...),
-    client: httpx.AsyncClient = Depends(get_async_client),
     user: User = Depends(get_user_info),
-    reverse_proxy: Any = Depends(_reverse_proxy),
 ) -> Any:
     """Creates an object
 
     Forwards the file to the API with multipart form data encoding
 
+    Each chunk is checked against its optional Upload-Checksum header (eg:
+    "sha256 <base64 digest>"), failing with 460 if it does not match. The
+    response to the last chunk has the digest of the whole file in the
+    Upload-Digest header.
     """
 
-    return reverse_proxy
+    hasher = ChunkHasher(patch, request)
+    response = await proxy_request(
+        request, user, content=hasher.stream(request.stream())
+    )
+    if response.status_code < 300:
+        digest = hasher.commit()
+        if digest is not None:
+            response.headers["Upload-Digest"] = digest
+
+    return response
 
 
 @router.head("")
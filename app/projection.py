@@ -0,0 +1,122 @@
+from typing import Any, AsyncIterator
+import codecs
+import json
+import orjson
+
+# Larger elements are assumed to be malformed rather than still incomplete
+MAX_ELEMENT_SIZE = 16 * 1024 * 1024
+
+# Always kept, as list views key their rows on it
+ID_FIELD = ("id",)
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class ProjectionError(ValueError):
+    pass
+
+
+def parse_fields(value: str) -> list[tuple[str, ...]]:
+    """Parse `fields=name,stats.frames` into paths of keys"""
+
+    paths = [
+        tuple(field.strip().split("."))
+        for field in value.split(",")
+        if field.strip()
+    ]
+    if paths and ID_FIELD not in paths:
+        paths.append(ID_FIELD)
+
+    return paths
+
+
+def project(value: Any, paths: list[tuple[str, ...]]) -> Any:
+    """Keep only the given paths of a record, missing ones are left out"""
+
+    if not isinstance(value, dict):
+        return value
+
+    projected = {}
+    for path in paths:
+        source, target = value, projected
+        for key in path[:-1]:
+            source = source.get(key) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if path[-1] in source:
+                target[path[-1]] = source[path[-1]]
+
+    return projected
+
+
+async def project_json(
+    chunks: AsyncIterator[bytes],
+    paths: list[tuple[str, ...]],
+) -> AsyncIterator[bytes]:
+    """Project each record of a streamed JSON array, or a single object
+
+    Elements of a top-level array are decoded one at a time as soon as they
+    are complete, so only the element being received is held in memory.
+    """
+
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    in_array = None  # Unknown until the first non-whitespace character
+    first = True
+
+    async for chunk in chunks:
+        buffer = buffer[position:] + text.decode(chunk)
+        position = 0
+
+        if in_array is None:
+            stripped = buffer.lstrip(_WHITESPACE)
+            if not stripped:
+                continue
+            in_array = stripped[0] == "["
+            if in_array:
+                position = len(buffer) - len(stripped) + 1
+                yield b"["
+
+        if not in_array:
+            continue  # A single object is projected once fully received
+
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                yield b"]"
+                return
+            if buffer[position] == "," and not first:
+                position += 1
+                continue
+
+            try:
+                element, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                element, end = None, None
+
+            # A number at the end of the buffer may not be complete yet
+            if end is None or end == len(buffer):
+                if len(buffer) - position > MAX_ELEMENT_SIZE:
+                    raise ProjectionError("JSON array element too large")
+                break
+
+            yield (b"" if first else b",") + orjson.dumps(
+                project(element, paths)
+            )
+            first = False
+            position = end
+
+    buffer = buffer[position:] + text.decode(b"", final=True)
+    if in_array:
+        raise ProjectionError("Incomplete JSON array")
+    if not buffer.strip(_WHITESPACE):
+        return
+
+    yield orjson.dumps(project(orjson.loads(buffer), paths))
@@ -0,0 +1,85 @@
+from typing import Iterable
+from fastapi import Request
+from fastapi.responses import Response
+from app.cache import get_cache
+from app.config import config
+from app.models.user import User
+from app.routing import UpstreamRoute
+import hashlib
+import httpx
+import orjson
+import uuid
+
+# Part of the cache keys of a collection's responses, replaced whenever a
+# write to the collection is proxied so that they are all dropped at once,
+# in every worker
+VERSION_KEY = "proxy:version:{collection}"
+VERSION_TTL = 24 * 60 * 60
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+async def _version(collection: str) -> str:
+    cache = get_cache()
+    key = VERSION_KEY.format(collection=collection)
+    version = await cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex.encode("utf-8")
+        await cache.set(key, version, ttl=VERSION_TTL)
+
+    return version.decode("utf-8")
+
+
+async def response_cache_key(
+    request: Request,
+    route: UpstreamRoute,
+    user: User,
+) -> str:
+    """Key of the response for this user, URL and accepted encodings"""
+
+    is_admin = "admin" in user.realm_roles
+    parts = [
+        user.id,
+        str(is_admin),
+        str(route.url(request)),
+        request.headers.get("accept-encoding", ""),
+    ]
+    digest = hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    version = await _version(route.collection)
+
+    return f"proxy:{route.collection}:{version}:{digest}"
+
+
+async def invalidate_responses(collections: Iterable[str]) -> None:
+    await get_cache().invalidate(
+        *(VERSION_KEY.format(collection=c) for c in collections)
+    )
+
+
+def dump_response(r: httpx.Response, body: bytes) -> bytes:
+    head = {"status": r.status_code, "headers": r.headers.multi_items()}
+    return orjson.dumps(head) + b"\n" + body
+
+
+def load_response(data: bytes) -> Response:
+    head, body = data.split(b"\n", 1)
+    head = orjson.loads(head)
+
+    return Response(
+        body,
+        status_code=head["status"],
+        headers=httpx.Headers(head["headers"]),
+    )
+
+
+async def cache_response(
+    key: str,
+    r: httpx.Response,
+    chunks: list[bytes],
+) -> None:
+    await get_cache().set(
+        key,
+        dump_response(r, b"".join(chunks)),
+        ttl=config.RESPONSE_CACHE_SECONDS,
+    )
@@ -0,0 +1,159 @@
+from fastapi import FastAPI, Request
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ConfigDict
+from urllib.parse import quote
+from app.config import config
+from app.models.route import RouteSettings
+import httpx
+import string
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class UpstreamRoute(BaseModel):
+    """A BFF route compiled against its upstream deepreefmap API route"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True, frozen=True)
+
+    method: str
+    path: str  # BFF route template, eg: /api/submissions/{submission_id}
+    upstream: str  # Upstream route template, eg: /v1/submissions/{...}
+    cacheable: bool
+    idempotent: bool
+    timeout: httpx.Timeout
+    streaming: bool
+    long_transfer: bool
+    projection: str | None
+    collection: str  # First segment of the upstream path, eg: submissions
+    invalidates: tuple[str, ...]  # Collections to drop cached responses of
+
+    def url(self, request: Request) -> httpx.URL:
+        """Build the upstream URL from the request path params and query"""
+
+        path = self.upstream.format_map(
+            {
+                key: quote(value, safe="")
+                for key, value in request.path_params.items()
+            }
+        )
+        query = request.url.query
+        if self.projection == "bff" and "fields" in request.query_params:
+            # Projected by the BFF, the API may not accept the parameter
+            query = "&".join(
+                part
+                for part in query.split("&")
+                if part.partition("=")[0] != "fields"
+            )
+
+        return httpx.URL(path=path, query=query.encode("utf-8"))
+
+
+class RouteTable:
+    """Lookup of compiled upstream routes by method and BFF route template"""
+
+    def __init__(self, routes: list[UpstreamRoute]):
+        self._routes = {(route.method, route.path): route for route in routes}
+
+    def __iter__(self):
+        return iter(self._routes.values())
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def get(self, method: str, path: str) -> UpstreamRoute | None:
+        return self._routes.get((method, path))
+
+    def resolve(self, request: Request) -> UpstreamRoute:
+        """Get the compiled route matched by the request
+
+        Raises a LookupError when the matched route was not compiled, which
+        happens only if routes are added to the app after startup.
+        """
+
+        route = request.scope.get("route")
+        upstream_route = self._routes.get(
+            (request.method, getattr(route, "path_format", None))
+        )
+        if upstream_route is None:
+            raise LookupError(
+                f"No upstream route for {request.method} {request.url.path}"
+            )
+
+        return upstream_route
+
+
+def _template_fields(template: str) -> set[str]:
+    return {
+        field
+        for _, field, _, _ in string.Formatter().parse(template)
+        if field is not None
+    }
+
+
+def compile_route(route: APIRoute, method: str) -> UpstreamRoute:
+    relative_path = route.path_format.removeprefix(config.API_PREFIX)
+    settings = config.ROUTE_SETTINGS.get(
+        f"{method} {relative_path}", RouteSettings()
+    )
+    upstream = f"{config.UPSTREAM_PREFIX}{settings.upstream or relative_path}"
+    collection = upstream.removeprefix(config.UPSTREAM_PREFIX).split("/")[1]
+
+    missing = _template_fields(upstream) - set(route.param_convertors)
+    if missing:
+        raise ValueError(
+            f"Upstream route {upstream} for {method} {route.path_format} "
+            f"uses unknown path parameters: {', '.join(sorted(missing))}"
+        )
+
+    return UpstreamRoute(
+        method=method,
+        path=route.path_format,
+        upstream=upstream,
+        cacheable=settings.cacheable,
+        idempotent=(
+            settings.idempotent
+            if settings.idempotent is not None
+            else method in IDEMPOTENT_METHODS
+        ),
+        timeout=(
+            httpx.Timeout(settings.timeout, connect=config.TIMEOUT.connect)
+            if settings.timeout is not None
+            else config.TIMEOUT
+        ),
+        streaming=settings.streaming,
+        long_transfer=settings.long_transfer,
+        projection=settings.projection,
+        collection=collection,
+        invalidates=tuple(
+            settings.invalidates
+            if settings.invalidates is not None
+            else [collection]
+        ),
+    )
+
+
+def compile_routes(app: FastAPI) -> RouteTable:
+    """Compile the route table for every API route registered on the app"""
+
+    table = RouteTable(
+        [
+            compile_route(route, method)
+            for route in app.routes
+            if isinstance(route, APIRoute)
+            and route.path_format.startswith(config.API_PREFIX)
+            for method in sorted(route.methods)
+        ]
+    )
+
+    # Catch typos in the configured settings rather than silently ignoring
+    compiled = {
+        f"{route.method} {route.path.removeprefix(config.API_PREFIX)}"
+        for route in table
+    }
+    unknown = set(config.ROUTE_SETTINGS) - compiled
+    if unknown:
+        raise ValueError(
+            f"Route settings for unknown routes: {', '.join(sorted(unknown))}"
+        )
+
+    return table
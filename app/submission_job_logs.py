@@ -1,7 +1,7 @@
 from typing import Any
 from fastapi import Depends, APIRouter
 from app.config import config
-from app.utils import get_async_client
+from app.utils import get_async_client, passthrough_response
 import httpx
 from app.models.user import User
 from app.auth import get_user_info
@@ -23,4 +23,4 @@ async def get_job_log(
         f"{config.DEEPREEFMAP_API_URL}/v1/submissions/logs/{job_id}",
     )
 
-    return res.json()
+    return passthrough_response(res)
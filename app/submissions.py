@@ -1,19 +1,131 @@
 from typing import Any
-from fastapi import Depends, APIRouter, Request, HTTPException
+from fastapi import Depends, APIRouter, Request, HTTPException, status
 from app.config import config
-from app.utils import get_async_client, _reverse_proxy
+from app.utils import (
+    get_async_client,
+    passthrough_response,
+    _reverse_proxy,
+)
 import httpx
+from urllib.parse import quote
 from uuid import UUID
 from app.models.user import User
-from app.models.token import DownloadToken
+from app.models.token import (
+    DownloadToken,
+    DownloadTokens,
+    DownloadTokensRequest,
+    FileDownloadToken,
+    check_filename,
+)
 from app.auth import require_admin, get_user_info
 from fastapi import BackgroundTasks
 from fastapi.responses import StreamingResponse
+from app.cache import TTLCache, get_cache
+from app.zipstream import stream_zip
+from app.drain import streams
 import jwt
 import datetime
+import time
 
 router = APIRouter()
 
+DOWNLOAD_TOKEN_CLAIMS = ["submission_id", "filename", "exp"]
+BUNDLE_TOKEN_CLAIMS = ["submission_id", "filenames", "exp"]
+
+# Verified download tokens, kept until they expire
+download_tokens = TTLCache(maxsize=config.DOWNLOAD_TOKEN_CACHE_SIZE)
+
+
+def issue_download_token(submission_id: UUID, **claims: Any) -> str:
+    payload = {
+        "submission_id": str(submission_id),
+        **claims,
+        "exp": datetime.datetime.now(datetime.UTC)
+        + datetime.timedelta(hours=config.SERIALIZER_EXPIRY_HOURS),
+    }
+
+    return jwt.encode(
+        payload, config.SERIALIZER_SECRET_KEY, algorithm="HS256"
+    )
+
+
+def verify_download_token(
+    token: str,
+    required: list[str] = DOWNLOAD_TOKEN_CLAIMS,
+) -> dict:
+    """Decode and validate a download token, caching it until it expires"""
+
+    claims = download_tokens.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(
+                token,
+                config.SERIALIZER_SECRET_KEY,
+                algorithms=["HS256"],
+                options={"require": ["exp"]},
+            )
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(
+                status_code=401,
+                detail="Token has expired",
+            )
+        except jwt.InvalidTokenError:
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid token",
+            )
+
+        download_tokens.set(token, claims, ttl=claims["exp"] - time.time())
+
+    # File and bundle tokens share the cache, so check claims on every hit
+    if any(claims.get(claim) is None for claim in required):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid token",
+        )
+
+    return claims
+
+
+async def authorise_submission(
+    request: Request,
+    client: httpx.AsyncClient,
+    user: User,
+    submission_id: UUID,
+) -> None:
+    """Validate that the submission exists and the user has access to it
+
+    Successful checks are cached for config.AUTHZ_CACHE_SECONDS so that
+    downloading several files from a submission only asks the API once.
+    """
+
+    cache = get_cache()
+    cache_key = f"authz:{user.id}:{submission_id}"
+    if await cache.get(cache_key) is not None:
+        return
+
+    # Only identify the user, the client's body headers do not apply here
+    headers = {
+        "User-ID": user.id,
+        "User-Is-Admin": str("admin" in user.realm_roles),
+    }
+    if "authorization" in request.headers:
+        headers["Authorization"] = request.headers["authorization"]
+    req = client.build_request(
+        "GET",
+        f"{config.DEEPREEFMAP_API_URL}/v1/submissions/{submission_id}",
+        headers=headers,
+    )
+    r = await client.send(req)
+
+    if r.status_code != 200:
+        raise HTTPException(
+            status_code=r.status_code,
+            detail=r.text,
+        )
+
+    await cache.set(cache_key, b"1", ttl=config.AUTHZ_CACHE_SECONDS)
+
 
 @router.delete("/kubernetes/jobs/{job_id}")
 async def delete_job(
@@ -28,7 +140,57 @@ async def delete_job(
         f"{config.DEEPREEFMAP_API_URL}/v1/submissions/kubernetes/jobs/{job_id}",
     )
 
-    return res.json()
+    return passthrough_response(res)
+
+
+@router.get("/download/bundle/{token}", response_class=StreamingResponse)
+async def get_submission_output_bundle(
+    request: Request,
+    *,
+    token: str,
+) -> StreamingResponse:
+    """Streams the files embedded in the bundle token as one ZIP archive
+
+    The archive is built on the fly without compression, fetching the next
+    files from the API while the current one is being sent.
+    """
+
+    claims = verify_download_token(token, BUNDLE_TOKEN_CLAIMS)
+    streams.reject_if_draining()
+    submission_id, filenames = claims["submission_id"], claims["filenames"]
+    client = request.state.client
+
+    def open_file(filename: str):
+        async def chunks():
+            req = client.build_request(
+                "GET",
+                f"{config.UPSTREAM_PREFIX}/submissions/"
+                f"{submission_id}/{quote(filename, safe='')}",
+            )
+            r = await client.send(req, stream=True)
+            try:
+                r.raise_for_status()
+                async for chunk in r.aiter_bytes():
+                    yield chunk
+            finally:
+                await r.aclose()
+
+        return chunks
+
+    return StreamingResponse(
+        content=streams.track(
+            stream_zip(
+                [(filename, open_file(filename)) for filename in filenames],
+                buffer_chunks=config.BUNDLE_BUFFER_CHUNKS,
+            )
+        ),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="{submission_id}.zip"'
+            )
+        },
+    )
 
 
 @router.get("/download/{token}", response_class=StreamingResponse)
@@ -46,30 +208,19 @@ async def get_submission_output_file(
     `GET /submissions/{submission_id}/{filename}`
     """
 
-    # Decode the token from the user
-    decoded = jwt.decode(
-        token, config.SERIALIZER_SECRET_KEY, algorithms=["HS256"]
-    )
-
-    submission_id, filename, exp = decoded.values()
-
-    if datetime.datetime.fromtimestamp(
-        exp, tz=datetime.timezone.utc
-    ) < datetime.datetime.now(datetime.UTC):
-        raise HTTPException(
-            status_code=401,
-            detail="Token has expired",
-        )
+    claims = verify_download_token(token)
+    submission_id, filename = claims["submission_id"], claims["filename"]
+    streams.reject_if_draining()
 
     req = client.build_request(
         "GET",
         f"{config.DEEPREEFMAP_API_URL}/v1/submissions/"
-        f"{submission_id}/{filename}",
+        f"{submission_id}/{quote(filename, safe='')}",
     )
     r = await client.send(req, stream=True)
 
     return StreamingResponse(
-        content=r.aiter_bytes(),
+        content=streams.track(r.aiter_bytes()),
         media_type="application/octet-stream",
         background=background_tasks.add_task(r.aclose),
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
@@ -104,41 +255,53 @@ async def get_submission_output_file_token(
     Token expires at a set time defined by config.SERIALIZER_EXPIRY_HOURS
     """
 
-    # Get the resource to validate that it exists and the user has access
-    is_admin = "admin" in user.realm_roles
-    headers = {
-        key.decode(): value.decode() for key, value in request.headers.raw
-    }
-    headers.update(  # Add user ID and roles to the headers
-        {
-            "User-ID": user.id,
-            "User-Is-Admin": str(is_admin),
-        }
-    )
-    req = client.build_request(
-        "GET",
-        f"{config.DEEPREEFMAP_API_URL}/v1/submissions/{submission_id}",
-        headers=headers,
-    )
-    r = await client.send(req)
-
-    if r.status_code != 200:
+    try:
+        check_filename(filename)
+    except ValueError as e:
         raise HTTPException(
-            status_code=r.status_code,
-            detail=r.text,
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e),
         )
 
-    payload = {
-        "submission_id": str(submission_id),
-        "filename": filename,
-        "exp": datetime.datetime.now(datetime.UTC)
-        + datetime.timedelta(hours=config.SERIALIZER_EXPIRY_HOURS),
-    }
-    token = jwt.encode(
-        payload, config.SERIALIZER_SECRET_KEY, algorithm="HS256"
+    # Get the resource to validate that it exists and the user has access
+    await authorise_submission(request, client, user, submission_id)
+
+    return DownloadToken(
+        token=issue_download_token(submission_id, filename=filename)
     )
 
-    return DownloadToken(token=token)
+
+@router.post("/{submission_id}/tokens", response_model=DownloadTokens)
+async def get_submission_output_file_tokens(
+    request: Request,
+    download: DownloadTokensRequest,
+    client: httpx.AsyncClient = Depends(get_async_client),
+    *,
+    submission_id: UUID,
+    user: User = Depends(get_user_info),
+) -> DownloadTokens:
+    """With the given ID and filenames, returns a token for each file
+
+    Access to the submission is checked once for all of the files. The
+    bundle token downloads all of the files as a single ZIP archive at:
+
+    `GET /submissions/download/bundle/{token}`
+    """
+
+    await authorise_submission(request, client, user, submission_id)
+
+    filenames = list(dict.fromkeys(download.filenames))  # Drop duplicates
+
+    return DownloadTokens(
+        tokens=[
+            FileDownloadToken(
+                filename=filename,
+                token=issue_download_token(submission_id, filename=filename),
+            )
+            for filename in filenames
+        ],
+        bundle=issue_download_token(submission_id, filenames=filenames),
+    )
 
 
 @router.post("/{submission_id}/execute", response_model=Any)
@@ -0,0 +1,397 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Iterator
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import config
+from app.metrics import metrics
+import anyio
+import asyncio
+import httpx
+import logging
+import orjson
+import os
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = re.compile(
+    r"^00-(?P<trace_id>[0-9a-f]{32})-(?P<span_id>[0-9a-f]{16})"
+    r"-(?P<flags>[0-9a-f]{2})$"
+)
+
+# Span kinds, as numbered by OTLP
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+
+class Span:
+    """A timed stage of a request, part of a W3C trace
+
+    Spans of unsampled traces are not recorded, but still carry the trace
+    context so that it is propagated to the API.
+    """
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "sampled",
+        "name",
+        "kind",
+        "start",
+        "end",
+        "attributes",
+        "error",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: str | None,
+        sampled: bool,
+        kind: int = INTERNAL,
+        start: int | None = None,
+    ):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.kind = kind
+        self.start = start or time.time_ns()
+        self.end: int | None = None
+        self.attributes: dict[str, Any] = {}
+        self.error: str | None = None
+
+    @property
+    def traceparent(self) -> str:
+        flags = "01" if self.sampled else "00"
+        return f"00-{self.trace_id}-{self.span_id}-{flags}"
+
+    def set(self, key: str, value: Any) -> None:
+        if self.sampled:
+            self.attributes[key] = value
+
+    def child(self, name: str, kind: int = INTERNAL, **kwargs) -> "Span":
+        return Span(
+            name, self.trace_id, self.span_id, self.sampled, kind, **kwargs
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "end": self.end,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_span: ContextVar[Span | None] = ContextVar(
+    "current_span", default=None
+)
+
+
+class FileExporter:
+    """Append spans as JSON lines to a local file, eg: to inspect offline"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: bytes) -> None:
+        with open(self.path, "ab") as f:
+            f.write(lines)
+
+    async def export(self, spans: list[Span]) -> None:
+        lines = b"".join(orjson.dumps(s.to_dict()) + b"\n" for s in spans)
+        await anyio.to_thread.run_sync(self._write, lines)
+
+    async def close(self) -> None:
+        pass
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPExporter:
+    """Send spans to an OpenTelemetry collector, with OTLP/HTTP and JSON"""
+
+    def __init__(self, url: str, service_name: str):
+        self.url = f"{url.rstrip('/')}/v1/traces"
+        self.resource = {
+            "attributes": [
+                {"key": "service.name", "value": _otlp_value(service_name)}
+            ]
+        }
+        self.client = httpx.AsyncClient(timeout=config.TIMEOUT)
+
+    def _span(self, span: Span) -> dict[str, Any]:
+        otlp = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start),
+            "endTimeUnixNano": str(span.end),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in span.attributes.items()
+            ],
+            "status": (
+                {"code": 2, "message": span.error}
+                if span.error is not None
+                else {"code": 0}
+            ),
+        }
+        if span.parent_id is not None:
+            otlp["parentSpanId"] = span.parent_id
+
+        return otlp
+
+    async def export(self, spans: list[Span]) -> None:
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [self._span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        res = await self.client.post(
+            self.url,
+            content=orjson.dumps(body),
+            headers={"content-type": "application/json"},
+        )
+        res.raise_for_status()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class Tracer:
+    """Sample requests, and export their finished spans in the background
+
+    Requests are sampled at sample_rate, or as their traceparent says if
+    trust_parent (clients could otherwise have any request traced). Spans
+    are exported in batches every interval, and dropped if the exporter
+    falls behind by more than max_queue spans.
+    """
+
+    def __init__(
+        self,
+        exporter: FileExporter | OTLPExporter | None,
+        sample_rate: float = 0.0,
+        trust_parent: bool = False,
+        interval: float = 5.0,
+        max_queue: int = 10000,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.trust_parent = trust_parent
+        self.interval = interval
+        self._queue: deque[Span] = deque(maxlen=max_queue)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start_trace(self, name: str, traceparent: str | None) -> Span:
+        """Continue the trace of an incoming request, or start a new one"""
+
+        sampled = random.random() < self.sample_rate
+        parent = TRACEPARENT.match(traceparent or "")
+        if parent is not None and parent["trace_id"] != "0" * 32:
+            if self.trust_parent:
+                sampled = bool(int(parent["flags"], 16) & 1)
+            return Span(
+                name,
+                parent["trace_id"],
+                parent["span_id"],
+                sampled=sampled,
+                kind=SERVER,
+            )
+
+        return Span(
+            name,
+            os.urandom(16).hex(),
+            None,
+            sampled=sampled,
+            kind=SERVER,
+        )
+
+    def finish(self, span: Span, end: int | None = None) -> None:
+        span.end = end or time.time_ns()
+        if span.sampled:
+            if len(self._queue) == self._queue.maxlen:
+                metrics.incr("tracing.dropped")
+            self._queue.append(span)
+
+    async def flush(self) -> None:
+        while self._queue:
+            spans = list(self._queue)
+            self._queue.clear()
+            try:
+                await self.exporter.export(spans)
+                metrics.incr("tracing.exported", len(spans))
+            except Exception as e:
+                logger.warning(f"Failed to export {len(spans)} spans: {e!r}")
+                metrics.incr("tracing.dropped", len(spans))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self.enabled:
+            await self.flush()
+            await self.exporter.close()
+
+
+@lru_cache()
+def get_tracer() -> Tracer:
+    """The tracer, exporting to TRACE_OTLP_URL or TRACE_FILE if either set"""
+
+    exporter = None
+    if config.TRACE_OTLP_URL:
+        exporter = OTLPExporter(config.TRACE_OTLP_URL, config.TRACE_SERVICE)
+    elif config.TRACE_FILE:
+        exporter = FileExporter(config.TRACE_FILE)
+
+    return Tracer(
+        exporter,
+        sample_rate=config.TRACE_SAMPLE_RATE,
+        trust_parent=config.TRACE_TRUST_PARENT,
+        interval=config.TRACE_EXPORT_SECONDS,
+    )
+
+
+@contextmanager
+def span(
+    name: str, kind: int = INTERNAL, **attributes: Any
+) -> Iterator[Span | None]:
+    """Trace a stage of the current request as a child of the current span
+
+    Yields None, at no cost, when the request is not being traced.
+    """
+
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = parent.child(name, kind)
+    for key, value in attributes.items():
+        child.set(key, value)
+
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        get_tracer().finish(child)
+
+
+def httpx_trace(parent: Span):
+    """Callback for httpx's trace extension, recording connection stages
+
+    The time spent waiting for a pooled connection, connecting, and waiting
+    for the API to respond are recorded as child spans of parent.
+    """
+
+    events: dict[str, int] = {}
+
+    async def trace(event: str, info: dict[str, Any]) -> None:
+        # eg: connection.connect_tcp.started, http11.send_request_headers...
+        _, _, stage = event.partition(".")
+        events.setdefault(stage, time.time_ns())
+        if stage != "receive_response_headers.complete":
+            return
+
+        tracer = get_tracer()
+        sent = events.get("send_request_headers.started", parent.start)
+        connecting = events.get("connect_tcp.started")  # Not if reused
+        pool_wait = parent.child("upstream.pool_wait", start=parent.start)
+        tracer.finish(pool_wait, end=connecting or sent)
+        if connecting is not None:
+            connect = parent.child("upstream.connect", start=connecting)
+            tracer.finish(connect, end=sent)
+
+        processing = parent.child(
+            "upstream.processing",
+            start=events.get("send_request_body.complete", sent),
+        )
+        tracer.finish(processing, end=events[stage])
+
+    return trace
+
+
+class TracingMiddleware:
+    """Trace each HTTP request, until its response body is fully sent"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        tracer = get_tracer()
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        root = tracer.start_trace(
+            f"{scope['method']} {scope['path']}",
+            Headers(scope=scope).get("traceparent"),
+        )
+        root.set("http.method", scope["method"])
+        root.set("http.target", scope["path"])
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message["status"])
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                # Named after the route template, rather than the path
+                root.name = f"{scope['method']} {route.path}"
+                root.set("http.route", route.path)
+            tracer.finish(root)
@@ -0,0 +1,153 @@
+from typing import AsyncIterator
+from fastapi import HTTPException, Request, status
+from app.cache import TTLCache
+from app.config import config
+from app.metrics import metrics
+import anyio
+import base64
+import binascii
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Algorithms accepted in Upload-Checksum headers, eg: "sha256 <base64>"
+CHECKSUM_ALGORITHMS = {"md5", "sha1", "sha256", "sha512"}
+
+# Status of a chunk not matching its checksum, as in the tus protocol
+CHECKSUM_MISMATCH = 460
+
+
+class UploadSession:
+    """Bytes of an upload received so far, and their running hash
+
+    The hash is None once a chunk was received by another worker, or out of
+    order, as the digest of the whole upload can then not be computed.
+    """
+
+    __slots__ = ("offset", "hash")
+
+    def __init__(self, offset: int = 0, hash=None):
+        self.offset = offset
+        self.hash = hash
+
+
+# Uploads in progress in this worker, keyed by their patch ID
+sessions = TTLCache(maxsize=config.UPLOAD_SESSION_CACHE_SIZE)
+
+
+def _int_header(request: Request, name: str) -> int | None:
+    try:
+        return int(request.headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def _update(hashes: list, data: bytes) -> None:
+    for h in hashes:
+        h.update(data)
+
+
+class ChunkHasher:
+    """Hash a chunk of an upload while it is relayed to the API
+
+    The chunk is checked against its Upload-Checksum header, if any, and
+    added to the running hash of the upload. The last piece of the chunk is
+    only sent once verified, so the API never receives a complete chunk
+    that does not match. The running hash is updated on a copy, kept only
+    once the API accepted the chunk (see commit()).
+    """
+
+    def __init__(self, upload_id: str, request: Request):
+        self.upload_id = upload_id
+        self.offset = _int_header(request, "upload-offset")
+        self.length = _int_header(request, "upload-length")
+        self.size = 0
+
+        self.checksum = None
+        self.expected = None
+        header = request.headers.get("upload-checksum")
+        if header is not None:
+            algorithm, _, value = header.partition(" ")
+            if algorithm.lower() not in CHECKSUM_ALGORITHMS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unsupported checksum algorithm: {algorithm}",
+                )
+            try:
+                self.expected = base64.b64decode(value, validate=True)
+            except binascii.Error:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid Upload-Checksum, expected base64",
+                )
+            self.checksum = hashlib.new(algorithm.lower())
+
+        session = sessions.get(upload_id)
+        if self.offset == 0:
+            session = UploadSession(
+                hash=hashlib.new(config.UPLOAD_DIGEST_ALGORITHM)
+            )
+        elif session is None or session.offset != self.offset:
+            session = UploadSession(self.offset or 0)  # Digest unknown
+        self.session = session
+        self.hash = session.hash.copy() if session.hash is not None else None
+
+    async def stream(
+        self, chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        hashes = [h for h in (self.hash, self.checksum) if h is not None]
+        previous = None
+        async for data in chunks:
+            if not data:
+                continue
+            if len(data) >= config.UPLOAD_HASH_THREAD_BYTES:
+                # hashlib releases the GIL for large updates
+                await anyio.to_thread.run_sync(_update, hashes, data)
+            else:
+                _update(hashes, data)
+            self.size += len(data)
+
+            if previous is not None:
+                yield previous
+            previous = data
+
+        if self.checksum is not None:
+            if self.checksum.digest() != self.expected:
+                metrics.incr("uploads.checksum_mismatches")
+                raise HTTPException(
+                    status_code=CHECKSUM_MISMATCH,
+                    detail="Upload-Checksum does not match the chunk",
+                )
+            metrics.incr("uploads.checksums_verified")
+
+        if previous is not None:
+            yield previous
+
+    def commit(self) -> str | None:
+        """Keep the chunk in the running hash, once accepted by the API
+
+        Returns the digest of the upload, as "<algorithm> <base64>", if the
+        chunk completed it and it could be computed.
+        """
+
+        offset = self.session.offset + self.size
+        if self.length is None or offset < self.length:
+            sessions.set(
+                self.upload_id,
+                UploadSession(offset, self.hash),
+                ttl=config.UPLOAD_SESSION_SECONDS,
+            )
+            return None
+
+        sessions.delete(self.upload_id)
+        if self.hash is None:
+            logger.info(f"Upload {self.upload_id} complete, digest unknown")
+            return None
+
+        digest = base64.b64encode(self.hash.digest()).decode("ascii")
+        logger.info(
+            f"Upload {self.upload_id} complete, {self.hash.name} {digest}"
+        )
+
+        return f"{self.hash.name} {digest}"
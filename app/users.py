@@ -1,17 +1,29 @@
-from typing import Any
+from typing import TYPE_CHECKING, Any, AsyncIterator, Literal
 from fastapi import Depends, APIRouter, Query, Response
+from fastapi.responses import StreamingResponse
 from app.config import config
 from uuid import UUID
 from app.models.user import User
 from app.auth import require_admin
-from keycloak import KeycloakAdmin, KeycloakOpenIDConnection
+from app.cache import get_cache
+from app.drain import streams
+from app.executor import run_blocking
+from app.utils import json_response
 from pydantic import BaseModel
 from enum import Enum
+import asyncio
+import csv
+import io
 import json
+import orjson
 
+if TYPE_CHECKING:
+    from keycloak import KeycloakAdmin
 
 router = APIRouter()
 
+ROLE_INDEX_KEY = "users:role_members"
+
 
 class UserRoles(str, Enum):
     admin = "admin"
@@ -22,7 +34,11 @@ class UserUpdate(BaseModel):
     role: UserRoles
 
 
-def get_keycloak_admin():
+def _create_keycloak_admin() -> "KeycloakAdmin":
+    from keycloak import KeycloakAdmin, KeycloakOpenIDConnection
+
+    # Shared by all requests, the connection fetches the service account
+    # token when created and refreshes it before it expires
     keycloak_connection = KeycloakOpenIDConnection(
         server_url=config.KEYCLOAK_URL,
         realm_name=config.KEYCLOAK_REALM,
@@ -33,6 +49,28 @@ def get_keycloak_admin():
     return KeycloakAdmin(connection=keycloak_connection)
 
 
+# Keycloak admin client, created once by the first request or the warm-up
+_keycloak_admin: "KeycloakAdmin | None" = None
+_keycloak_admin_lock = asyncio.Lock()
+
+
+async def get_keycloak_admin() -> "KeycloakAdmin":
+    """Get the Keycloak admin client
+
+    python-keycloak is synchronous, so its calls must be made with
+    run_blocking() to keep them off the event loop.
+    """
+
+    global _keycloak_admin
+
+    if _keycloak_admin is None:
+        async with _keycloak_admin_lock:
+            if _keycloak_admin is None:
+                _keycloak_admin = await run_blocking(_create_keycloak_admin)
+
+    return _keycloak_admin
+
+
 class KeycloakUser(BaseModel):
     username: str | None
     firstName: str | None
@@ -44,14 +82,15 @@ class KeycloakUser(BaseModel):
     approved_user: bool | None = False
 
 
-def get_user(
+async def get_user(
     user_id: str,
-    keycloak_admin: KeycloakAdmin,
+    keycloak_admin: "KeycloakAdmin",
 ) -> KeycloakUser:
 
-    user = keycloak_admin.get_user(user_id)
-
-    roles = keycloak_admin.get_realm_roles_of_user(user_id=user_id)
+    user, roles = await asyncio.gather(
+        run_blocking(keycloak_admin.get_user, user_id),
+        run_blocking(keycloak_admin.get_realm_roles_of_user, user_id=user_id),
+    )
     admin = any(role["name"] == "admin" for role in roles)
     approved_user = any(role["name"] == "user" for role in roles) or admin
 
@@ -69,27 +108,157 @@ def get_user(
     )
 
 
+async def get_role_members(keycloak: "KeycloakAdmin") -> dict[str, list[dict]]:
+    """Get the members of the admin and user roles, by role name
+
+    The index is cached for config.ROLE_INDEX_CACHE_SECONDS and invalidated
+    in every worker when a user's roles are changed.
+    """
+
+    cache = get_cache()
+    members = await cache.get_json(ROLE_INDEX_KEY)
+    if members is None:
+        admin_users, general_users = await asyncio.gather(
+            run_blocking(keycloak.get_realm_role_members, "admin"),
+            run_blocking(keycloak.get_realm_role_members, "user"),
+        )
+        members = {"admin": admin_users, "user": general_users}
+        await cache.set_json(
+            ROLE_INDEX_KEY, members, ttl=config.ROLE_INDEX_CACHE_SECONDS
+        )
+
+    return members
+
+
+def _user_row(user: dict, admin: bool, approved: bool) -> dict[str, Any]:
+    return {
+        "username": user.get("username"),
+        "firstName": user.get("firstName"),
+        "lastName": user.get("lastName"),
+        "email": user.get("email"),
+        "id": user.get("id"),
+        "loginMethod": user.get("attributes", {})
+        .get("login-method", ["EPFL"])[0]
+        .upper(),
+        "admin": admin,
+        "approved_user": approved,
+    }
+
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+# Spreadsheets evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _escape_cell(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def _encode_rows(rows: list[dict], format: str) -> bytes:
+    if format == "ndjson":
+        return b"".join(orjson.dumps(row) + b"\n" for row in rows)
+
+    # User fields are set by the users themselves, so they are escaped
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(KeycloakUser.model_fields))
+    writer.writerows(
+        {key: _escape_cell(value) for key, value in row.items()}
+        for row in rows
+    )
+    return buffer.getvalue().encode("utf-8")
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_users(
+    user: User = Depends(require_admin),
+    keycloak: "KeycloakAdmin" = Depends(get_keycloak_admin),
+    *,
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+) -> StreamingResponse:
+    """Export all users with their roles, as NDJSON or CSV
+
+    Users are fetched from Keycloak a page at a time, the next page while
+    the current one is sent, so the whole realm is never held in memory.
+    Role membership is fetched once for the whole export.
+    """
+
+    streams.reject_if_draining()
+
+    members = await get_role_members(keycloak)
+    admins = {member["id"] for member in members["admin"]}
+    approved = admins | {member["id"] for member in members["user"]}
+    page_size = config.USER_EXPORT_PAGE_SIZE
+
+    def get_page(first: int) -> asyncio.Future:
+        return asyncio.ensure_future(
+            run_blocking(
+                keycloak.get_users, query={"first": first, "max": page_size}
+            )
+        )
+
+    async def export() -> AsyncIterator[bytes]:
+        if format == "csv":
+            yield ",".join(KeycloakUser.model_fields).encode("utf-8") + b"\r\n"
+
+        first = 0
+        page = get_page(first)
+        try:
+            while True:
+                users = await page
+                first += len(users)
+                if len(users) == page_size:
+                    page = get_page(first)
+
+                yield _encode_rows(
+                    [
+                        _user_row(
+                            user, user["id"] in admins, user["id"] in approved
+                        )
+                        for user in users
+                    ],
+                    format,
+                )
+                if len(users) < page_size:
+                    return
+        finally:
+            page.cancel()
+
+    return StreamingResponse(
+        streams.track(export()),
+        media_type=EXPORT_FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="users.{format}"'
+        },
+    )
+
+
 @router.get("/{user_id}", response_model=KeycloakUser)
 async def get_one_user(
     user_id: str,
-    keycloak_admin: KeycloakAdmin = Depends(get_keycloak_admin),
+    keycloak_admin: "KeycloakAdmin" = Depends(get_keycloak_admin),
     user: User = Depends(require_admin),
 ) -> KeycloakUser:
     """Get a user by id"""
 
-    return get_user(user_id, keycloak_admin)
+    return await get_user(user_id, keycloak_admin)
 
 
 @router.get("", response_model=list[KeycloakUser])
 async def get_users(
-    response: Response,
     user: User = Depends(require_admin),
-    keycloak: KeycloakAdmin = Depends(get_keycloak_admin),
+    keycloak: "KeycloakAdmin" = Depends(get_keycloak_admin),
     *,
     filter: str = Query(None),
     sort: str = Query(None),
     range: str = Query(None),
-) -> list[KeycloakUser]:
+) -> Response:
     """Get a list of users
 
     This endpoint is used to get a list of users from Keycloak. It is used
@@ -104,8 +273,8 @@ async def get_users(
     filter = json.loads(filter) if filter else {}
 
     # Return only current users, to reduce load on Keycloak
-    admin_users = keycloak.get_realm_role_members("admin")
-    general_users = keycloak.get_realm_role_members("user")
+    members = await get_role_members(keycloak)
+    admin_users, general_users = members["admin"], members["user"]
 
     user_dict = {}
 
@@ -128,15 +297,13 @@ async def get_users(
         if "username" in filter:
             query["username"] = filter["username"]
 
-        users = keycloak.get_users(query=query)
+        users = await run_blocking(keycloak.get_users, query=query)
 
     if len(range) == 2:
         start, end = range
     else:
         start, end = [0, len(users) + 1]
 
-    response.headers["Content-Range"] = f"users {start}-{end}/{len(users)}"
-
     user_objs = []
     for user in users[start : end + 1]:
         approved = False
@@ -144,29 +311,21 @@ async def get_users(
         if user.get("id") in user_dict:
             approved = user_dict[user["id"]].get("approved_user", False)
             admin = user_dict[user["id"]].get("admin", False)
-        user_objs.append(
-            KeycloakUser(
-                email=user.get("email"),
-                username=user.get("username"),
-                id=user.get("id"),
-                firstName=user.get("firstName"),
-                lastName=user.get("lastName"),
-                admin=admin,
-                approved_user=approved,
-                loginMethod=user.get("attributes", {})
-                .get("login-method", ["EPFL"])[0]
-                .upper(),
-            )
-        )
+        user_objs.append(_user_row(user, admin, approved))
 
-    return user_objs
+    # Serialised as is, only validated against the model in DEBUG mode
+    return json_response(
+        user_objs,
+        list[KeycloakUser],
+        headers={"Content-Range": f"users {start}-{end}/{len(users)}"},
+    )
 
 
 @router.put("/{user_id}")
 async def update_user(
     user_id: UUID,
     user_update: UserUpdate,
-    keycloak_admin: KeycloakAdmin = Depends(get_keycloak_admin),
+    keycloak_admin: "KeycloakAdmin" = Depends(get_keycloak_admin),
     user: User = Depends(require_admin),
 ) -> Any:
     """Updates the role of the user"""
@@ -176,9 +335,11 @@ async def update_user(
     roles_to_assign = [user_update.role.value]
 
     # Get the role objects from keycloak
-    realm_roles = keycloak_admin.get_realm_roles(["admin", "user"])
+    realm_roles, current_userroles = await asyncio.gather(
+        run_blocking(keycloak_admin.get_realm_roles, ["admin", "user"]),
+        run_blocking(keycloak_admin.get_realm_roles_of_user, user_id=user_id),
+    )
     roles = [role for role in realm_roles if role["name"] in roles_to_assign]
-    current_userroles = keycloak_admin.get_realm_roles_of_user(user_id=user_id)
 
     roles_to_add = []
     roles_to_delete = []
@@ -196,21 +357,25 @@ async def update_user(
         else:
             roles_to_delete.append(userrole)
 
-    keycloak_admin.assign_realm_roles(
+    await run_blocking(
+        keycloak_admin.assign_realm_roles,
         user_id=user_id,
         roles=roles_to_add,
     )
-    keycloak_admin.delete_realm_roles_of_user(
+    await run_blocking(
+        keycloak_admin.delete_realm_roles_of_user,
         user_id=user_id,
         roles=roles_to_delete,
     )
-    return get_user(user_id, keycloak_admin)
+    await get_cache().invalidate(ROLE_INDEX_KEY)
+
+    return await get_user(user_id, keycloak_admin)
 
 
 @router.delete("/{user_id}")
 async def delete_user(
     user_id: str,
-    keycloak_admin: KeycloakAdmin = Depends(get_keycloak_admin),
+    keycloak_admin: "KeycloakAdmin" = Depends(get_keycloak_admin),
     user: User = Depends(require_admin),
 ) -> Any:
     """Deleting a user removes them from the roles of 'admin' and 'user'
@@ -219,9 +384,11 @@ async def delete_user(
     """
 
     # Get the role objects from keycloak
-    realm_roles = keycloak_admin.get_realm_roles(["admin", "user"])
+    realm_roles, current_userroles = await asyncio.gather(
+        run_blocking(keycloak_admin.get_realm_roles, ["admin", "user"]),
+        run_blocking(keycloak_admin.get_realm_roles_of_user, user_id=user_id),
+    )
     roles = [role for role in realm_roles if role["name"] in ["admin", "user"]]
-    current_userroles = keycloak_admin.get_realm_roles_of_user(user_id=user_id)
 
     roles_to_delete = []
     for userrole in current_userroles:
@@ -229,8 +396,11 @@ async def delete_user(
             if role["id"] == userrole["id"]:
                 roles_to_delete.append(userrole)
 
-    keycloak_admin.delete_realm_roles_of_user(
+    await run_blocking(
+        keycloak_admin.delete_realm_roles_of_user,
         user_id=user_id,
         roles=roles_to_delete,
     )
-    return get_user(user_id, keycloak_admin)
+    await get_cache().invalidate(ROLE_INDEX_KEY)
+
+    return await get_user(user_id, keycloak_admin)
@@ -1,14 +1,32 @@
 import httpx
 from fastapi import FastAPI, Request
 from starlette.background import BackgroundTask
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from contextlib import asynccontextmanager
 from app.config import config
-from typing import Any
+from typing import Any, AsyncIterator
 from fastapi import Depends, APIRouter
+from functools import lru_cache
+from pydantic import TypeAdapter
 from app.models.user import User
 from app.auth import get_user_info
+from app.routing import compile_routes
+from app.projection import parse_fields, project_json
+from app.cache import get_cache
+from app.drain import streams
+from app.metrics import metrics
+from app.tracing import CLIENT, get_tracer, httpx_trace, span
+from app.response_cache import (
+    SAFE_METHODS,
+    cache_response,
+    invalidate_responses,
+    load_response,
+    response_cache_key,
+)
+import asyncio
+import logging
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -19,26 +37,112 @@ async def get_async_client():
         yield client
 
 
+@lru_cache()
+def _type_adapter(model: Any) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def json_response(
+    content: Any,
+    model: Any = None,
+    **kwargs: Any,
+) -> ORJSONResponse:
+    """Serialise content with orjson, bypassing FastAPI's response model
+
+    Keep the response_model on the route for the OpenAPI schema. The content
+    is only validated against the model in DEBUG mode, as building pydantic
+    models dominates the cost of large payloads.
+    """
+
+    if config.DEBUG and model is not None:
+        _type_adapter(model).validate_python(content)
+
+    return ORJSONResponse(content, **kwargs)
+
+
+def passthrough_response(r: httpx.Response) -> Response:
+    """Relay an upstream (JSON) response body without decoding it"""
+
+    return Response(
+        r.content,
+        status_code=r.status_code,
+        media_type=r.headers.get("content-type", "application/json"),
+    )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with httpx.AsyncClient(
-        base_url=f"{config.DEEPREEFMAP_API_URL}",
-        timeout=config.TIMEOUT,
-        limits=config.LIMITS,
-    ) as client:
-        yield {"client": client}
+    routes = compile_routes(app)
+
+    if config.DEBUG:
+        # asyncio logs callbacks blocking the loop longer than the duration
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = config.SLOW_CALLBACK_SECONDS
+        logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+    cache = get_cache()
+    tracer = get_tracer()
+    await cache.start()
+    await tracer.start()
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"{config.DEEPREEFMAP_API_URL}",
+            timeout=config.TIMEOUT,
+            limits=config.LIMITS,
+        ) as client:
+            # Imported here as it depends on the routers, which import this
+            from app.warmup import warm_up
+
+            await warm_up(client)
+            imports = metrics.get("startup.import_seconds")
+            warmup = metrics.get("startup.warmup_seconds")
+            logger.info(
+                f"Ready after {imports:.3f}s of imports "
+                f"and {warmup:.3f}s of warm-up"
+            )
+            watcher = asyncio.create_task(
+                streams.watch(config.DRAIN_TIMEOUT_SECONDS)
+            )
+            try:
+                yield {"client": client, "routes": routes}
+            finally:
+                watcher.cancel()
+    finally:
+        await tracer.close()
+        await cache.close()
 
 
 async def _reverse_proxy(
     request: Request,
     user: User = Depends(get_user_info),
 ):
+    return await proxy_request(request, user)
+
+
+async def proxy_request(
+    request: Request,
+    user: User,
+    content: AsyncIterator[bytes] | None = None,
+) -> Response:
+    """Relay the request to its upstream route, as the given user
+
+    The request body is streamed to the API as it is received, unless the
+    content to send instead is given (eg: the body, hashed as it is sent).
+    """
+
     client = request.state.client
-    path = request.url.path.replace("/api", "/v1")
-    url = httpx.URL(
-        path=path,
-        query=request.url.query.encode("utf-8"),
-    )
+    route = request.state.routes.resolve(request)
+    if content is None:
+        content = request.stream()
+    # Long transfers are counted once: uploads as they are received,
+    # downloads as they are sent
+    upload = route.long_transfer and request.method not in SAFE_METHODS
+    download = route.long_transfer and not upload
+    if route.long_transfer:
+        streams.reject_if_draining()
+    if upload:
+        content = streams.track(content)
     is_admin = "admin" in user.realm_roles
     headers = {
         key.decode(): value.decode() for key, value in request.headers.raw
@@ -50,15 +154,89 @@ async def _reverse_proxy(
         }
     )
 
-    req = client.build_request(
-        request.method,
-        url,
-        headers=headers,
-        content=request.stream(),
+    fields = None
+    if route.projection == "bff" and "fields" in request.query_params:
+        fields = parse_fields(request.query_params["fields"])
+        # The records are parsed to project them, have them sent unencoded
+        headers["accept-encoding"] = "identity"
+
+    cache_key = None
+    if (
+        route.cacheable
+        and not fields
+        and request.method == "GET"
+        and config.RESPONSE_CACHE_SECONDS > 0
+    ):
+        cache_key = await response_cache_key(request, route, user)
+        cached = await get_cache().get(cache_key)
+        if cached is not None:
+            return load_response(cached)
+
+    url = route.url(request)
+    with span("upstream", CLIENT, **{"http.url": str(url)}) as s:
+        extensions = {}
+        if s is not None:
+            # Propagate the trace to the API, as a child of this span
+            headers["traceparent"] = s.traceparent
+            if s.sampled:
+                extensions["trace"] = httpx_trace(s)
+        req = client.build_request(
+            request.method,
+            url,
+            headers=headers,
+            content=content,
+            timeout=route.timeout,
+            extensions=extensions,
+        )
+        r = await client.send(req, stream=True)
+        if s is not None:
+            s.set("http.status_code", r.status_code)
+    if (
+        request.method not in SAFE_METHODS
+        and r.status_code < 400
+        and route.invalidates
+    ):
+        # The write may change the cached responses of these collections
+        await invalidate_responses(route.invalidates)
+
+    if (
+        fields
+        and r.status_code == 200
+        and r.headers.get("content-type", "").startswith("application/json")
+    ):
+        # Projected from the decoded body, should the API encode it anyway
+        response_headers = httpx.Headers(r.headers)
+        response_headers.pop("content-length", None)
+        response_headers.pop("content-encoding", None)
+        return StreamingResponse(
+            project_json(r.aiter_bytes(), fields),
+            status_code=r.status_code,
+            headers=response_headers,
+            background=BackgroundTask(r.aclose),
+        )
+
+    # Only small, complete responses are cached, large ones stay streamed
+    content_length = int(r.headers.get("content-length", -1))
+    cache_this = (
+        cache_key is not None
+        and r.status_code == 200
+        and 0 <= content_length <= config.RESPONSE_CACHE_MAX_BYTES
     )
-    r = await client.send(req, stream=True)
+    if not route.streaming or cache_this:
+        try:
+            chunks = [chunk async for chunk in r.aiter_raw()]
+        finally:
+            await r.aclose()
+        if cache_this:
+            await cache_response(cache_key, r, chunks)
+        return Response(
+            b"".join(chunks),
+            status_code=r.status_code,
+            headers=r.headers,
+        )
+
     return StreamingResponse(
-        r.aiter_raw(),
+        streams.track(r.aiter_raw()) if download else r.aiter_raw(),
         status_code=r.status_code,
         headers=r.headers,
         background=BackgroundTask(r.aclose),
@@ -0,0 +1,64 @@
+from typing import Awaitable
+from app.auth import get_idp_public_key, get_keycloak_openid
+from app.config import config
+from app.executor import run_blocking
+from app.metrics import metrics
+from app.users import get_keycloak_admin
+import asyncio
+import httpx
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+async def _step(name: str, step: Awaitable) -> bool:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(step, config.WARMUP_TIMEOUT_SECONDS)
+    except Exception as e:
+        # The first requests will do it instead, a little slower
+        logger.warning(f"Warm-up of {name} failed: {e!r}")
+        metrics.incr("startup.warmup_failed")
+        return False
+    finally:
+        metrics.set(
+            f"startup.warmup.{name}_seconds", time.perf_counter() - started
+        )
+
+    return True
+
+
+async def _open_connections(client: httpx.AsyncClient) -> None:
+    """Fill the pool with connections to the API, kept alive for requests"""
+
+    async def request() -> None:
+        # HEAD of the root needs no work from the API, unlike /v1/status
+        res = await client.head("/")
+        await res.aclose()  # Any status will do, the connection is open
+
+    await asyncio.gather(
+        *(request() for _ in range(config.WARMUP_CONNECTIONS))
+    )
+
+
+async def warm_up(client: httpx.AsyncClient) -> None:
+    """Prefetch what the first requests would otherwise wait for
+
+    The realm public key, the Keycloak service account token and pooled
+    connections to the API are fetched concurrently. Failures are logged
+    and do not prevent the app from starting.
+    """
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        _step("public_key", get_idp_public_key(client)),
+        _step("keycloak_openid", run_blocking(get_keycloak_openid)),
+        _step("keycloak_admin", get_keycloak_admin()),
+        _step("api_connections", _open_connections(client)),
+    )
+    duration = time.perf_counter() - started
+    metrics.set("startup.warmup_seconds", duration)
+    logger.info(
+        f"Warmed up {sum(results)}/{len(results)} steps in {duration:.3f}s"
+    )
@@ -0,0 +1,109 @@
+from contextlib import aclosing
+from typing import AsyncIterator, Callable
+import asyncio
+import logging
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# A member of the archive: its name and a callable opening its content
+ZipMember = tuple[str, Callable[[], AsyncIterator[bytes]]]
+
+_END = object()
+
+
+class _ChunkWriter:
+    """Unseekable file-like sink holding what ZipFile writes until drained
+
+    As the sink cannot seek, ZipFile writes each member with a trailing data
+    descriptor instead of rewriting its local header, so nothing needs to be
+    kept once it has been drained.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _prefetch(
+    queue: asyncio.Queue,
+    open_member: Callable[[], AsyncIterator[bytes]],
+) -> bool:
+    try:
+        async with aclosing(open_member()) as chunks:
+            async for chunk in chunks:
+                await queue.put(chunk)
+    except Exception as e:
+        await queue.put(e)
+        return False
+
+    await queue.put(_END)
+    return True
+
+
+async def _prefetch_all(
+    members: list[ZipMember],
+    queues: list[asyncio.Queue],
+    writing: asyncio.Semaphore,
+) -> None:
+    for (_, open_member), queue in zip(members, queues):
+        await writing.acquire()
+        if not await _prefetch(queue, open_member):
+            return  # The archive is aborted
+
+
+async def stream_zip(
+    members: list[ZipMember],
+    *,
+    buffer_chunks: int = 16,
+) -> AsyncIterator[bytes]:
+    """Stream a store mode (uncompressed) ZIP64 archive of the members
+
+    Members are fetched one at a time. The next one is fetched once the one
+    being written is fully buffered, with at most `buffer_chunks` chunks
+    left to write, so its response is never left open and unread for long
+    and memory stays bounded whatever the size of the archive. A failing
+    member aborts the archive, so that clients never mistake a partial
+    bundle for a complete one.
+    """
+
+    queues = [asyncio.Queue(maxsize=buffer_chunks) for _ in members]
+    writing = asyncio.Semaphore(2)  # The member written, and the next one
+
+    sink = _ChunkWriter()
+    task = asyncio.create_task(_prefetch_all(members, queues, writing))
+    try:
+        with zipfile.ZipFile(sink, mode="w") as archive:
+            for (name, _), queue in zip(members, queues):
+                chunk = await queue.get()
+                if isinstance(chunk, Exception):
+                    logger.warning(f"Aborting archive at {name}: {chunk!r}")
+                    raise chunk
+
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                with archive.open(info, mode="w", force_zip64=True) as member:
+                    while chunk is not _END:
+                        if isinstance(chunk, Exception):
+                            raise chunk
+                        member.write(chunk)
+                        yield sink.drain()
+                        chunk = await queue.get()
+
+                writing.release()
+                yield sink.drain()
+
+        yield sink.drain()
+    finally:
+        task.cancel()
@@ -0,0 +1,177 @@
+"""Fake deepreefmap API and Keycloak servers for the benchmarks
+
+Both are plain FastAPI apps, served in-process by the benchmark harness so
+that the BFF can be measured without any external service.
+"""
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+import json
+import time
+import uuid
+import jwt
+
+CHUNK = b"\0" * (1024 * 1024)
+
+
+def make_records(count: int) -> bytes:
+    """A JSON list shaped like the API's submission/object listings"""
+
+    return json.dumps(
+        [
+            {
+                "id": str(uuid.UUID(int=i)),
+                "name": f"transect-{i}",
+                "description": "Reef survey " * 8,
+                "owner": str(uuid.UUID(int=i % 17)),
+                "created_on": "2024-06-12T15:30:54",
+                "last_updated": "2024-06-12T15:30:54",
+                "processing_has_started": True,
+                "processing_completed_successfully": i % 3 == 0,
+                "fps": 30.0,
+                "time_seconds_start": 0,
+                "time_seconds_end": 120,
+                "stats": {
+                    "size_bytes": 1024**3,
+                    "duration_seconds": 120.0,
+                    "frames": 3600,
+                    "percent_cover": {f"class_{c}": c / 10 for c in range(10)},
+                },
+            }
+            for i in range(count)
+        ]
+    ).encode("utf-8")
+
+
+def create_fake_api(list_size: int, download_bytes: int) -> FastAPI:
+    app = FastAPI()
+    listing = make_records(list_size)
+
+    @app.get("/v1/{collection}")
+    async def get_collection(collection: str) -> Response:
+        return Response(
+            listing,
+            media_type="application/json",
+            headers={"Content-Range": f"{collection} 0-{list_size}"},
+        )
+
+    @app.get("/v1/submissions/{submission_id}")
+    async def get_submission(
+        submission_id: str, request: Request
+    ) -> Response:
+        if "content-length" in request.headers:
+            # A real server would wait for a body that is never sent
+            return JSONResponse({"detail": "Unexpected body"}, 400)
+        return JSONResponse({"id": submission_id})
+
+    @app.get("/v1/submissions/{submission_id}/{filename}")
+    async def get_file(submission_id: str, filename: str) -> Response:
+        async def chunks():
+            remaining = download_bytes
+            while remaining > 0:
+                chunk = CHUNK[: min(remaining, len(CHUNK))]
+                remaining -= len(chunk)
+                yield chunk
+
+        return StreamingResponse(
+            chunks(),
+            media_type="application/octet-stream",
+            headers={"Content-Length": str(download_bytes)},
+        )
+
+    @app.patch("/v1/objects")
+    async def upload_chunk(request: Request) -> Response:
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+
+        return Response(
+            status_code=204,
+            headers={"Upload-Offset": str(received)},
+        )
+
+    return app
+
+
+class FakeKeycloak:
+    """Issues RS256 tokens and serves the realm and admin endpoints used"""
+
+    def __init__(self, realm: str, users: int):
+        self.realm = realm
+        self.rotate_key()
+        self.users = [
+            {
+                "id": str(uuid.UUID(int=i)),
+                "username": f"user{i}",
+                "email": f"user{i}@example.org",
+                "firstName": "Test",
+                "lastName": f"User {i}",
+                "attributes": {"login-method": ["epfl"]},
+            }
+            for i in range(users)
+        ]
+
+    def rotate_key(self) -> None:
+        """Sign tokens with a new key, as after a realm key rotation"""
+
+        self.private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048
+        )
+        pem = (
+            self.private_key.public_key()
+            .public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+            .decode("utf-8")
+        )
+        self.public_key = "".join(pem.strip().splitlines()[1:-1])
+
+    def token(self, *roles: str, lifetime: int = 3600) -> str:
+        return jwt.encode(
+            {
+                "sub": str(uuid.uuid4()),
+                "preferred_username": "benchmark",
+                "email": "benchmark@example.org",
+                "given_name": "Bench",
+                "family_name": "Mark",
+                "realm_access": {"roles": list(roles)},
+                "exp": int(time.time()) + lifetime,
+            },
+            self.private_key,
+            algorithm="RS256",
+        )
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI()
+        realm = f"/realms/{self.realm}"
+        admin = f"/admin/realms/{self.realm}"
+
+        @app.get(realm)
+        async def get_realm() -> dict:
+            return {"realm": self.realm, "public_key": self.public_key}
+
+        @app.post(f"{realm}/protocol/openid-connect/token")
+        async def get_token() -> dict:
+            return {
+                "access_token": self.token("admin"),
+                "expires_in": 3600,
+                "refresh_expires_in": 0,
+                "token_type": "Bearer",
+            }
+
+        @app.get(f"{admin}/roles/{{role}}/users")
+        async def get_role_members(
+            role: str, first: int = 0, max: int = 100
+        ) -> list[dict]:
+            # Every tenth user is an admin, every other one a user
+            step = 10 if role == "admin" else 2
+            return self.users[::step][first : first + max]
+
+        @app.get(f"{admin}/users")
+        async def get_users(first: int = 0, max: int = 100) -> list[dict]:
+            return self.users[first : first + max]
+
+        return app
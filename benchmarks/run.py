@@ -0,0 +1,325 @@
+"""Benchmark the BFF against in-process fake API and Keycloak servers
+
+The BFF runs as a uvicorn subprocess so that its RSS can be measured on its
+own. Run from the repository root with:
+
+    python -m benchmarks.run [--scenarios list download ...] [--json out]
+"""
+
+from benchmarks.fakes import FakeKeycloak, create_fake_api
+from dataclasses import dataclass, field
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import uvicorn
+
+REALM = "benchmark"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(
+        uvicorn.Config(app, port=port, log_level="warning", access_log=False)
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    return server
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest rank percentile of the sorted values"""
+
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, round(percent / 100 * len(values)))]
+
+
+def rss_bytes(pid: int) -> int | None:
+    """Resident set size of the process and its children, on Linux only
+
+    Children are included for runs with several uvicorn workers.
+    """
+
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            rss = next(
+                int(line.split()[1]) * 1024
+                for line in status
+                if line.startswith("VmRSS:")
+            )
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            return rss + sum(
+                rss_bytes(int(child)) or 0 for child in children.read().split()
+            )
+    except (OSError, StopIteration):
+        return None
+
+
+@dataclass
+class Result:
+    scenario: str
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+    latencies: list[float] = field(default_factory=list, repr=False)
+    max_rss: int | None = None
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "scenario": self.scenario,
+            "requests": self.requests,
+            "errors": self.errors,
+            "requests_per_second": self.requests / self.seconds,
+            "megabytes_per_second": self.bytes / self.seconds / 1024**2,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_rss_mb": (
+                self.max_rss / 1024**2 if self.max_rss is not None else None
+            ),
+        }
+
+
+async def run_scenario(
+    name: str,
+    request,
+    *,
+    total: int,
+    concurrency: int,
+    pid: int,
+) -> Result:
+    """Run `total` calls of `request` with at most `concurrency` in flight
+
+    `request` is an async callable returning the number of bytes moved, the
+    RSS of the BFF is sampled while the scenario runs.
+    """
+
+    result = Result(scenario=name)
+    queue = iter(range(total))
+
+    async def worker():
+        for _ in queue:
+            started = time.perf_counter()
+            try:
+                result.bytes += await request()
+            except Exception:
+                result.errors += 1
+            result.latencies.append(time.perf_counter() - started)
+            result.requests += 1
+
+    async def sample_rss():
+        while True:
+            rss = rss_bytes(pid)
+            if rss is not None:
+                result.max_rss = max(result.max_rss or 0, rss)
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.seconds = time.perf_counter() - started
+    sampler.cancel()
+
+    return result
+
+
+def scenarios(client: httpx.AsyncClient, keycloak: FakeKeycloak, args):
+    user = {"Authorization": f"Bearer {keycloak.token('user')}"}
+    admin = {"Authorization": f"Bearer {keycloak.token('admin')}"}
+    submission_id = uuid.uuid4()
+
+    async def list_submissions() -> int:
+        res = await client.get(
+            "/api/submissions", params={"range": "[0,99]"}, headers=user
+        )
+        res.raise_for_status()
+        return len(res.content)
+
+    async def download() -> int:
+        res = await client.get(
+            f"/api/submissions/{submission_id}/output.zip", headers=user
+        )
+        res.raise_for_status()
+        size = 0
+        async with client.stream(
+            "GET", f"/api/submissions/download/{res.json()['token']}"
+        ) as res:
+            res.raise_for_status()
+            async for chunk in res.aiter_raw():
+                size += len(chunk)
+
+        return size
+
+    async def upload() -> int:
+        chunk = b"\0" * (1024 * 1024)
+
+        async def body():
+            for _ in range(args.upload_mb):
+                yield chunk
+
+        res = await client.patch(
+            "/api/objects",
+            params={"patch": str(uuid.uuid4())},
+            headers={**user, "Content-Length": str(args.upload_mb * 1024**2)},
+            content=body(),
+        )
+        res.raise_for_status()
+        return args.upload_mb * 1024**2
+
+    async def list_users() -> int:
+        res = await client.get(
+            "/api/users", params={"range": "[0,49]"}, headers=admin
+        )
+        res.raise_for_status()
+        return len(res.content)
+
+    return {
+        "list": (list_submissions, args.requests, args.concurrency),
+        "download": (download, args.downloads, 1),
+        "upload": (upload, args.uploads, args.upload_concurrency),
+        "users": (list_users, args.requests, args.concurrency),
+    }
+
+
+async def benchmark(args, bff_url: str, pid: int, keycloak: FakeKeycloak):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    timeout = httpx.Timeout(60.0)
+    async with httpx.AsyncClient(
+        base_url=bff_url, limits=limits, timeout=timeout
+    ) as client:
+        available = scenarios(client, keycloak, args)
+        results = []
+        for name in args.scenarios:
+            request, total, concurrency = available[name]
+            if name in ("list", "users"):
+                await request()  # Warm up connections and caches
+            results.append(
+                await run_scenario(
+                    name,
+                    request,
+                    total=total,
+                    concurrency=concurrency,
+                    pid=pid,
+                )
+            )
+
+    return [result.summary() for result in results]
+
+
+def print_table(summaries: list[dict]) -> None:
+    columns = list(summaries[0])
+    print(" ".join(f"{column:>20}" for column in columns))
+    for summary in summaries:
+        print(
+            " ".join(
+                (
+                    f"{value:>20.2f}"
+                    if isinstance(value, float)
+                    else f"{str(value):>20}"
+                )
+                for value in summary.values()
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=["list", "download", "upload", "users"],
+        choices=["list", "download", "upload", "users"],
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--list-size", type=int, default=100)
+    parser.add_argument("--realm-users", type=int, default=2000)
+    parser.add_argument("--download-gb", type=float, default=2.0)
+    parser.add_argument("--downloads", type=int, default=2)
+    parser.add_argument("--upload-mb", type=int, default=64)
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--response-cache-seconds",
+        type=int,
+        default=0,
+        help="Disabled by default, to measure the proxying and not the cache",
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    keycloak = FakeKeycloak(REALM, users=args.realm_users)
+    api_port, keycloak_port, bff_port = free_port(), free_port(), free_port()
+    serve_in_thread(
+        create_fake_api(args.list_size, int(args.download_gb * 1024**3)),
+        api_port,
+    )
+    serve_in_thread(keycloak.create_app(), keycloak_port)
+
+    env = {
+        **os.environ,
+        "KEYCLOAK_REALM": REALM,
+        "KEYCLOAK_URL": f"http://127.0.0.1:{keycloak_port}",
+        "KEYCLOAK_CLIENT_ID": "benchmark-ui",
+        "KEYCLOAK_BFF_ID": "benchmark-bff",
+        "KEYCLOAK_BFF_SECRET": "benchmark",
+        "DEEPREEFMAP_API_URL": f"http://127.0.0.1:{api_port}",
+        "SERIALIZER_SECRET_KEY": "benchmark",
+        "RESPONSE_CACHE_SECONDS": str(args.response_cache_seconds),
+    }
+    bff = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            f"--port={bff_port}",
+            f"--workers={args.workers}",
+            "--log-level=warning",
+            "--no-access-log",
+        ],
+        env=env,
+    )
+    bff_url = f"http://127.0.0.1:{bff_port}"
+    try:
+        while True:
+            try:
+                httpx.get(f"{bff_url}/healthz").raise_for_status()
+                break
+            except httpx.TransportError:
+                if bff.poll() is not None:
+                    sys.exit("The BFF failed to start")
+                time.sleep(0.1)
+
+        summaries = asyncio.run(benchmark(args, bff_url, bff.pid, keycloak))
+    finally:
+        bff.terminate()
+        bff.wait()
+
+    print_table(summaries)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from contextlib import asynccontextmanager
+import os
+
+# Settings are read when app.config is first imported
+os.environ.update(
+    {
+        "KEYCLOAK_REALM": "test",
+        "KEYCLOAK_URL": "http://keycloak",
+        "KEYCLOAK_CLIENT_ID": "test-ui",
+        "KEYCLOAK_BFF_ID": "test-bff",
+        "KEYCLOAK_BFF_SECRET": "test",
+        "DEEPREEFMAP_API_URL": "http://api",
+        "SERIALIZER_SECRET_KEY": "test-secret-key-of-at-least-32-bytes",
+    }
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from benchmarks.fakes import FakeKeycloak, create_fake_api  # noqa: E402
+from app.config import config  # noqa: E402
+from app.main import app  # noqa: E402
+from app.routing import compile_routes  # noqa: E402
+from app.utils import get_async_client  # noqa: E402
+from fastapi import Request  # noqa: E402
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def keycloak() -> FakeKeycloak:
+    # Shared, as the BFF caches the realm public key
+    return FakeKeycloak(config.KEYCLOAK_REALM, users=20)
+
+
+@pytest.fixture
+def api():
+    return create_fake_api(list_size=5, download_bytes=100_000)
+
+
+@pytest.fixture
+def client(api, keycloak):
+    """Client of the BFF, with the fake API and Keycloak behind it"""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with httpx.AsyncClient(
+            base_url=config.DEEPREEFMAP_API_URL,
+            mounts={
+                config.DEEPREEFMAP_API_URL: httpx.ASGITransport(app=api),
+                config.KEYCLOAK_URL: httpx.ASGITransport(
+                    app=keycloak.create_app()
+                ),
+            },
+        ) as client:
+            yield {"client": client, "routes": compile_routes(app)}
+
+    async def shared_client(request: Request):
+        # Endpoints opening their own client would miss the fakes
+        yield request.state.client
+
+    original = app.router.lifespan_context
+    app.router.lifespan_context = lifespan
+    app.dependency_overrides[get_async_client] = shared_client
+    try:
+        with TestClient(app) as client:
+            yield client
+    finally:
+        app.router.lifespan_context = original
+        app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def user(keycloak) -> dict[str, str]:
+    return {"Authorization": f"Bearer {keycloak.token('user')}"}
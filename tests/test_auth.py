@@ -0,0 +1,40 @@
+from app.config import config
+from benchmarks.fakes import FakeKeycloak
+import app.auth
+import pytest
+
+
+@pytest.fixture
+def keycloak(monkeypatch) -> FakeKeycloak:
+    # Rotated by the tests, so not shared with other tests
+    monkeypatch.setattr(app.auth, "_public_key", None)
+    return FakeKeycloak(config.KEYCLOAK_REALM, users=1)
+
+
+def get_transects(client, token: str) -> int:
+    res = client.get(
+        "/api/transects", headers={"Authorization": f"Bearer {token}"}
+    )
+    return res.status_code
+
+
+def test_rotated_key_is_fetched(client, keycloak, monkeypatch):
+    monkeypatch.setattr(config, "PUBLIC_KEY_REFRESH_SECONDS", 0)
+    assert get_transects(client, keycloak.token("user")) == 200
+
+    keycloak.rotate_key()
+
+    assert get_transects(client, keycloak.token("user")) == 200
+
+
+def test_key_refreshes_are_rate_limited(client, keycloak):
+    assert get_transects(client, keycloak.token("user")) == 200
+
+    keycloak.rotate_key()
+
+    # Fetched too recently to be fetched again for a bad signature
+    assert get_transects(client, keycloak.token("user")) == 401
+
+
+def test_invalid_token(client, keycloak):
+    assert get_transects(client, keycloak.token("user")[:-4]) == 401
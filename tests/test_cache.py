@@ -0,0 +1,79 @@
+from app.cache import MemoryCache, RedisCache
+import anyio
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+async def caches():
+    """Two workers' caches, sharing one Redis server"""
+
+    server = fakeredis.FakeServer()
+    caches = [
+        RedisCache(client=fakeredis.FakeAsyncRedis(server=server))
+        for _ in range(2)
+    ]
+    for cache in caches:
+        await cache.start()
+    await anyio.sleep(0.1)  # Let the listeners subscribe
+    yield caches
+    for cache in caches:
+        await cache.close()
+
+
+async def wait_for(condition, timeout: float = 2.0) -> None:
+    with anyio.fail_after(timeout):
+        while not await condition():
+            await anyio.sleep(0.01)
+
+
+@pytest.mark.anyio
+async def test_redis_values_are_shared(caches):
+    a, b = caches
+
+    await a.set_json("key", {"value": 1}, ttl=60)
+
+    assert await b.get_json("key") == {"value": 1}
+
+
+@pytest.mark.anyio
+async def test_redis_invalidation_clears_other_workers(caches):
+    a, b = caches
+    await a.set("key", b"old", ttl=60)
+    assert await b.get("key") == b"old"  # Now in b's near cache
+
+    # Bypass a's delete, as if another worker had written the new value
+    await a._redis.set("key", b"new")
+    assert await b.get("key") == b"old"
+
+    await a.publish(["key"])
+
+    async def refreshed() -> bool:
+        return await b.get("key") == b"new"
+
+    await wait_for(refreshed)
+
+
+@pytest.mark.anyio
+async def test_redis_invalidate_deletes(caches):
+    a, b = caches
+    await a.set("key", b"value", ttl=60)
+    assert await b.get("key") == b"value"
+
+    await a.invalidate("key")
+
+    async def deleted() -> bool:
+        return await b.get("key") is None
+
+    await wait_for(deleted)
+
+
+@pytest.mark.anyio
+async def test_memory_cache_expiry():
+    cache = MemoryCache(maxsize=2)
+    await cache.set("a", b"1", ttl=60)
+    await cache.set("b", b"2", ttl=0)  # Not stored
+    await cache.set("c", b"3", ttl=60)
+    await cache.set("d", b"4", ttl=60)  # Evicts a
+
+    assert [await cache.get(key) for key in "abcd"] == [None, None, b"3", b"4"]
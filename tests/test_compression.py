@@ -0,0 +1,184 @@
+from app.compression import CompressionMiddleware
+from benchmarks.fakes import make_records
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+import gzip
+import json
+import pytest
+import uuid
+import zlib
+
+SUBMISSION_ID = str(uuid.UUID(int=7))
+LISTING = make_records(20)
+STATUS = b'{"status": "ok"}'
+
+
+def create_api() -> FastAPI:
+    """An API with small, large, streamed and already compressed bodies"""
+
+    app = FastAPI()
+
+    @app.get("/v1/transects")
+    async def get_transects() -> Response:
+        return Response(LISTING, media_type="application/json")
+
+    @app.get("/v1/status")
+    async def get_status() -> Response:
+        return Response(STATUS, media_type="application/json")
+
+    @app.get("/v1/objects")
+    async def get_objects() -> Response:
+        async def chunks():
+            for i in range(0, len(LISTING), 4096):
+                yield LISTING[i : i + 4096]
+
+        return StreamingResponse(chunks(), media_type="application/json")
+
+    @app.get("/v1/submissions")
+    async def get_submissions() -> Response:
+        return Response(
+            gzip.compress(LISTING),
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip"},
+        )
+
+    return app
+
+
+def get(client, user, path: str, accept_encoding: str):
+    return client.get(
+        path, headers={**user, "Accept-Encoding": accept_encoding}
+    )
+
+
+@pytest.mark.parametrize("api", [create_api()])
+def test_gzip(client, user):
+    res = get(client, user, "/api/transects", "gzip")
+
+    assert res.status_code == 200
+    assert res.headers["content-encoding"] == "gzip"
+    assert "content-length" not in res.headers
+    assert "Accept-Encoding" in res.headers["vary"]
+    assert res.content == LISTING
+
+
+@pytest.mark.parametrize("api", [create_api()])
+def test_brotli_is_preferred_when_installed(client, user):
+    pytest.importorskip("brotli")
+
+    res = get(client, user, "/api/transects", "gzip, deflate, br")
+
+    assert res.headers["content-encoding"] == "br"
+    assert res.content == LISTING
+
+
+@pytest.mark.parametrize("api", [create_api()])
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [("br;q=0, gzip", "gzip"), ("gzip;q=0", None), ("identity", None)],
+)
+def test_refused_encodings(client, user, accept_encoding, encoding):
+    res = get(client, user, "/api/transects", accept_encoding)
+
+    assert res.headers.get("content-encoding") == encoding
+    assert res.content == LISTING
+
+
+@pytest.mark.parametrize("api", [create_api()])
+def test_small_bodies_are_sent_as_they_are(client, user):
+    res = get(client, user, "/api/status", "gzip, br")
+
+    assert "content-encoding" not in res.headers
+    assert res.headers["content-length"] == str(len(STATUS))
+    assert res.content == STATUS
+
+
+def test_downloads_are_not_compressed(client, user):
+    res = client.get(f"/api/submissions/{SUBMISSION_ID}/a.mp4", headers=user)
+    res = get(
+        client,
+        {},
+        f"/api/submissions/download/{res.json()['token']}",
+        "gzip, br",
+    )
+
+    assert res.headers["content-type"] == "application/octet-stream"
+    assert "content-encoding" not in res.headers
+    assert len(res.content) == 100_000
+
+
+def test_bundles_are_not_compressed(client, user):
+    res = client.post(
+        f"/api/submissions/{SUBMISSION_ID}/tokens",
+        json={"filenames": ["a.mp4"]},
+        headers=user,
+    )
+    res = get(
+        client,
+        {},
+        f"/api/submissions/download/bundle/{res.json()['bundle']}",
+        "gzip, br",
+    )
+
+    assert res.headers["content-type"] == "application/zip"
+    assert "content-encoding" not in res.headers
+
+
+@pytest.mark.parametrize("api", [create_api()])
+def test_encoded_upstream_responses_are_untouched(client, user):
+    res = get(client, user, "/api/submissions", "gzip, br")
+
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.content == LISTING
+
+
+@pytest.mark.parametrize("api", [create_api()])
+def test_streamed_bodies(client, user):
+    res = get(client, user, "/api/objects", "gzip")
+
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.content == LISTING
+
+
+@pytest.mark.anyio
+async def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    chunks = [
+        json.dumps({"chunk": i, "data": "x" * 1024}).encode() for i in range(4)
+    ]
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        for i, chunk in enumerate(chunks):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": i < len(chunks) - 1,
+                }
+            )
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "headers": [(b"accept-encoding", b"gzip")],
+    }
+    await CompressionMiddleware(app, minimum_size=1024)(scope, None, send)
+
+    bodies = [m["body"] for m in sent if m["type"] == "http.response.body"]
+    assert len(bodies) == len(chunks)
+    # Each chunk can be decompressed as soon as it is received
+    decompressor = zlib.decompressobj(31)
+    for body, chunk in zip(bodies, chunks):
+        assert decompressor.decompress(body) == chunk
+    assert decompressor.eof
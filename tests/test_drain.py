@@ -0,0 +1,96 @@
+from app.config import config
+from app.drain import StreamTracker, streams
+import asyncio
+import os
+import pytest
+import time
+import uuid
+
+DRAIN_TOKEN = "drain-token"
+
+
+@pytest.fixture
+def drain_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "DRAIN_TOKEN", DRAIN_TOKEN)
+    monkeypatch.setattr(streams, "_flag", tmp_path / "draining")
+    # Restored once the test has drained the worker
+    for name in ["draining", "drained", "aborted", "_aborting"]:
+        monkeypatch.setattr(streams, name, getattr(streams, name))
+
+
+def drain(client, token: str | None = DRAIN_TOKEN):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    return client.post("/drain", headers=headers)
+
+
+def test_drain_requires_the_token(client, drain_token):
+    assert drain(client, token=None).status_code == 403
+    assert drain(client, token="wrong").status_code == 403
+    assert client.get("/readyz").status_code == 200
+
+
+def test_drain_is_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(config, "DRAIN_TOKEN", None)
+
+    assert drain(client, token="None").status_code == 403
+
+
+def test_draining_worker_is_alive_but_not_ready(client, user, drain_token):
+    res = drain(client)
+
+    assert res.status_code == 200
+    assert res.json() == {"drained": 0, "aborted": 0}
+    assert client.get("/healthz").status_code == 200
+    assert client.get("/readyz").status_code == 503
+    res = client.get(
+        f"/api/submissions/{uuid.UUID(int=0)}/a.mp4", headers=user
+    )
+    res = client.get(f"/api/submissions/download/{res.json()['token']}")
+    assert res.status_code == 503
+
+
+@pytest.mark.anyio
+async def test_draining_a_worker_drains_the_others(tmp_path):
+    flag = tmp_path / "draining"
+    workers = [StreamTracker(flag) for _ in range(2)]
+    watcher = asyncio.create_task(workers[1].watch(1.0, interval=0.01))
+
+    await workers[0].drain(1.0)
+
+    await asyncio.wait_for(watcher, 1.0)
+    assert workers[1].draining
+
+
+@pytest.mark.anyio
+async def test_flags_of_earlier_runs_are_ignored(tmp_path):
+    flag = tmp_path / "draining"
+    flag.touch()
+    os.utime(flag, (time.time() - 60, time.time() - 60))
+    worker = StreamTracker(flag)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(worker.watch(1.0, interval=0.01), 0.1)
+    assert not worker.draining
+
+
+def test_uploads_are_tracked_once_and_listings_not(client, user, monkeypatch):
+    tracked = []
+
+    def track(chunks):
+        tracked.append(chunks)
+        return chunks
+
+    monkeypatch.setattr(streams, "track", track)
+
+    res = client.patch(
+        "/api/objects",
+        params={"patch": str(uuid.uuid4())},
+        content=b"data",
+        headers={**user, "Upload-Offset": "0", "Upload-Length": "4"},
+    )
+    assert res.status_code == 204
+    assert len(tracked) == 1
+
+    assert client.get("/api/objects", headers=user).status_code == 200
+    assert client.get("/api/transects?fields=id", headers=user).is_success
+    assert len(tracked) == 1
@@ -0,0 +1,28 @@
+from app.config import config
+import pytest
+
+METRICS_TOKEN = "metrics-token"
+
+
+@pytest.fixture
+def metrics_token(monkeypatch):
+    monkeypatch.setattr(config, "METRICS_TOKEN", METRICS_TOKEN)
+
+
+def get_metrics(client, token: str | None):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    return client.get("/metrics", headers=headers)
+
+
+def test_metrics_require_the_token(client, metrics_token):
+    assert get_metrics(client, None).status_code == 403
+    assert get_metrics(client, "wrong").status_code == 403
+
+    res = get_metrics(client, METRICS_TOKEN)
+    assert res.status_code == 200
+    assert isinstance(res.json(), dict)
+
+
+def test_metrics_are_disabled_without_a_token(client):
+    assert config.METRICS_TOKEN is None
+    assert get_metrics(client, "None").status_code == 403
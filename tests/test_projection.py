@@ -0,0 +1,127 @@
+from app.projection import ProjectionError, parse_fields, project_json
+from fastapi import FastAPI, Request, Response
+import gzip
+import json
+import pytest
+import random
+
+RECORDS = [
+    {
+        "id": i,
+        "name": f"récif-{i} €",
+        "stats": {"frames": i, "cover": [1, {"a": "]"}]},
+        "note": 'a"],{',
+    }
+    for i in range(50)
+]
+
+
+async def project(data: bytes, fields: str, seed: int = 0) -> bytes:
+    """Project data received in random chunks, to split tokens and chars"""
+
+    rng = random.Random(seed)
+    chunks, i = [], 0
+    while i < len(data):
+        size = rng.randint(1, 40)
+        chunks.append(data[i : i + size])
+        i += size
+
+    async def receive():
+        for chunk in chunks:
+            yield chunk
+
+    return b"".join(
+        [part async for part in project_json(receive(), parse_fields(fields))]
+    )
+
+
+def test_parse_fields_always_keeps_id():
+    assert parse_fields("name, stats.frames,") == [
+        ("name",),
+        ("stats", "frames"),
+        ("id",),
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("seed", range(10))
+async def test_array_split_at_any_boundary(seed):
+    data = json.dumps(RECORDS, ensure_ascii=False, indent=1).encode("utf-8")
+
+    projected = await project(data, "name,stats.frames,missing.x", seed)
+
+    assert json.loads(projected) == [
+        {"name": r["name"], "stats": {"frames": r["stats"]["frames"]}, "id": i}
+        for i, r in enumerate(RECORDS)
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "value",
+    [[], [1, 22, 333, "x", None, True, [1]], {"id": 1, "name": "a", "z": 2}],
+)
+async def test_other_values(value):
+    projected = await project(json.dumps(value).encode("utf-8"), "name")
+
+    expected = {"id": 1, "name": "a"} if isinstance(value, dict) else value
+    assert json.loads(projected) == expected
+
+
+@pytest.mark.anyio
+async def test_empty_body():
+    assert await project(b"", "name") == b""
+
+
+@pytest.mark.anyio
+async def test_incomplete_array():
+    with pytest.raises(ProjectionError):
+        await project(b'[{"id": 1}, {"id"', "name")
+
+
+def test_proxied_listing_is_projected(client, user):
+    res = client.get(
+        "/api/transects",
+        params={"fields": "name,stats.frames"},
+        headers={**user, "Accept-Encoding": "identity"},
+    )
+
+    assert res.status_code == 200
+    assert res.json()[0] == {
+        "name": "transect-0",
+        "stats": {"frames": 3600},
+        "id": "00000000-0000-0000-0000-000000000000",
+    }
+
+
+def create_gzip_api() -> FastAPI:
+    """An API compressing its listings, whatever the client accepts"""
+
+    app = FastAPI()
+
+    @app.get("/v1/{collection}")
+    async def get_collection(request: Request) -> Response:
+        data = json.dumps(RECORDS).encode("utf-8")
+        return Response(
+            gzip.compress(data),
+            media_type="application/json",
+            headers={
+                "Content-Encoding": "gzip",
+                "X-Accept-Encoding": request.headers["accept-encoding"],
+            },
+        )
+
+    return app
+
+
+@pytest.mark.parametrize("api", [create_gzip_api()])
+def test_compressed_listing_is_projected(client, user):
+    res = client.get(
+        "/api/transects",
+        params={"fields": "name"},
+        headers={**user, "Accept-Encoding": "gzip"},
+    )
+
+    assert res.status_code == 200
+    assert res.headers["x-accept-encoding"] == "identity"
+    assert res.json() == [{"name": r["name"], "id": r["id"]} for r in RECORDS]
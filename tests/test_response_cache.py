@@ -0,0 +1,68 @@
+from collections import Counter
+from fastapi import FastAPI, Request, Response
+import pytest
+
+
+def create_counting_api() -> FastAPI:
+    """An API counting the reads of each collection"""
+
+    app = FastAPI()
+    app.state.reads = Counter()
+
+    @app.get("/v1/{collection}")
+    async def get_collection(collection: str) -> list:
+        app.state.reads[collection] += 1
+        return []
+
+    @app.post("/v1/{collection}")
+    async def create(collection: str) -> Response:
+        return Response(status_code=201)
+
+    @app.patch("/v1/objects")
+    async def upload_chunk(request: Request) -> Response:
+        await request.body()
+        return Response(status_code=204)
+
+    return app
+
+
+def read(client, user, api, *collections: str) -> dict[str, int]:
+    """Read the collections, counting those that reached the API"""
+
+    before = api.state.reads.copy()
+    for collection in collections:
+        assert (
+            client.get(f"/api/{collection}", headers=user).status_code == 200
+        )
+
+    return dict(api.state.reads - before)
+
+
+@pytest.mark.parametrize("api", [create_counting_api()])
+def test_writes_drop_their_collection_only(client, user, api):
+    assert read(client, user, api, "transects", "submissions") == {
+        "transects": 1,
+        "submissions": 1,
+    }
+    assert read(client, user, api, "transects", "submissions") == {}
+
+    assert client.post("/api/transects", headers=user).status_code == 201
+
+    assert read(client, user, api, "transects", "submissions") == {
+        "transects": 1
+    }
+
+
+@pytest.mark.parametrize("api", [create_counting_api()])
+def test_upload_chunks_keep_cached_responses(client, user, api):
+    assert read(client, user, api, "objects") == {"objects": 1}
+
+    res = client.patch(
+        "/api/objects",
+        params={"patch": "upload"},
+        content=b"chunk",
+        headers={**user, "Upload-Offset": "0", "Upload-Length": "10"},
+    )
+
+    assert res.status_code == 204
+    assert read(client, user, api, "objects") == {}
@@ -0,0 +1,9 @@
+import subprocess
+import sys
+
+
+def test_keycloak_is_imported_on_first_use():
+    # In a new interpreter, as the other tests have imported it already
+    code = "import sys, app.main; assert 'keycloak' not in sys.modules"
+
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,156 @@
+from app.submissions import verify_download_token
+from app.zipstream import stream_zip
+import io
+import pytest
+import uuid
+import zipfile
+
+SUBMISSION_ID = str(uuid.UUID(int=7))
+
+
+def test_file_tokens_and_bundle(client, user):
+    res = client.post(
+        f"/api/submissions/{SUBMISSION_ID}/tokens",
+        json={"filenames": ["a.mp4", "b.csv", "a.mp4"]},
+        headers=user,
+    )
+
+    assert res.status_code == 200
+    tokens = res.json()
+    assert [t["filename"] for t in tokens["tokens"]] == ["a.mp4", "b.csv"]
+    claims = verify_download_token(tokens["tokens"][1]["token"])
+    assert (claims["submission_id"], claims["filename"]) == (
+        SUBMISSION_ID,
+        "b.csv",
+    )
+
+    res = client.get(f"/api/submissions/download/bundle/{tokens['bundle']}")
+
+    assert res.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(res.content))
+    assert archive.namelist() == ["a.mp4", "b.csv"]
+    assert archive.testzip() is None
+    assert len(archive.read("b.csv")) == 100_000
+
+
+def test_file_token(client, user):
+    res = client.get(f"/api/submissions/{SUBMISSION_ID}/a.mp4", headers=user)
+
+    assert res.status_code == 200
+    res = client.get(f"/api/submissions/download/{res.json()['token']}")
+    assert res.status_code == 200
+    assert len(res.content) == 100_000
+
+
+def test_file_tokens_require_a_bundle_token(client, user):
+    res = client.get(f"/api/submissions/{SUBMISSION_ID}/a.mp4", headers=user)
+
+    res = client.get(f"/api/submissions/download/bundle/{res.json()['token']}")
+    assert res.status_code == 401
+
+
+def member(*chunks: bytes, error: Exception | None = None):
+    async def open_member():
+        for chunk in chunks:
+            yield chunk
+        if error is not None:
+            raise error
+
+    return open_member
+
+
+@pytest.mark.anyio
+async def test_zip_is_aborted_by_a_missing_member():
+    members = [
+        ("a", member(b"a" * 10)),
+        ("missing", member(error=FileNotFoundError("missing"))),
+        ("c", member(b"c" * 10)),
+    ]
+
+    data = b""
+    with pytest.raises(FileNotFoundError):
+        async for chunk in stream_zip(members):
+            data += chunk
+
+    assert b"missing" not in data  # Nothing claims the archive is complete
+    with pytest.raises(zipfile.BadZipFile):
+        zipfile.ZipFile(io.BytesIO(data))
+
+
+@pytest.mark.parametrize(
+    "filename",
+    [f"../{uuid.UUID(int=9)}/secret.mp4", "..", ".", "", "a\\b", "a\nb"],
+)
+def test_filenames_stay_in_the_submission(client, user, filename):
+    res = client.post(
+        f"/api/submissions/{SUBMISSION_ID}/tokens",
+        json={"filenames": ["a.mp4", filename]},
+        headers=user,
+    )
+
+    assert res.status_code == 422
+
+
+def test_file_token_rejects_invalid_filenames(client, user):
+    res = client.get(f"/api/submissions/{SUBMISSION_ID}/a%5Cb", headers=user)
+
+    assert res.status_code == 422
+
+
+def test_filenames_are_quoted(client, user):
+    res = client.post(
+        f"/api/submissions/{SUBMISSION_ID}/tokens",
+        json={"filenames": ["a b#?.mp4"]},
+        headers=user,
+    )
+    token = res.json()["tokens"][0]["token"]
+
+    res = client.get(f"/api/submissions/download/{token}")
+
+    assert res.status_code == 200
+    assert len(res.content) == 100_000
+
+
+@pytest.mark.parametrize(
+    "filenames",
+    [[], [f"{i}.mp4" for i in range(101)], [f"{i:0>250}" for i in range(13)]],
+)
+def test_bundles_are_limited(client, user, filenames):
+    res = client.post(
+        f"/api/submissions/{SUBMISSION_ID}/tokens",
+        json={"filenames": filenames},
+        headers=user,
+    )
+
+    assert res.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_zip_fetches_the_next_member_when_close_to_written():
+    events = []
+
+    def counted(name: str, count: int):
+        async def open_member():
+            events.append(("open", name))
+            for _ in range(count):
+                yield b"x" * 10
+
+        return open_member
+
+    members = [(name, counted(name, 100)) for name in "abc"]
+    written = 0
+    async for chunk in stream_zip(members, buffer_chunks=4):
+        written += bool(chunk)
+        events.append(("written", written))
+
+    # b is opened once a is fully buffered, c once b is
+    opened = {
+        event[1]: max(
+            [n for kind, n in events[:i] if kind == "written"], default=0
+        )
+        for i, event in enumerate(events)
+        if event[0] == "open"
+    }
+    assert opened["a"] == 0
+    assert opened["b"] >= 100 - 4 - 1
+    assert opened["c"] >= 200 - 4 - 1
@@ -0,0 +1,94 @@
+from app.config import config
+from app.tracing import TRACEPARENT, Tracer, get_tracer
+from fastapi import FastAPI, Request
+import asyncio
+import json
+import pytest
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+def create_echo_api() -> FastAPI:
+    """An API returning the traceparent it received"""
+
+    app = FastAPI()
+
+    @app.get("/v1/{collection}")
+    async def get_collection(request: Request) -> dict:
+        return {"traceparent": request.headers.get("traceparent")}
+
+    return app
+
+
+@pytest.fixture
+def trace_file(monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(config, "TRACE_FILE", str(path))
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(config, "RESPONSE_CACHE_SECONDS", 0)
+    get_tracer.cache_clear()
+    yield path
+    get_tracer.cache_clear()
+
+
+def read_spans(path) -> list[dict]:
+    asyncio.run(get_tracer().flush())
+    if not path.exists():
+        return []
+
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def traceparent(sampled: bool) -> str:
+    return f"00-{TRACE_ID}-{PARENT_ID}-{'01' if sampled else '00'}"
+
+
+@pytest.mark.parametrize("api", [create_echo_api()])
+def test_trusted_parent_is_traced(client, user, trace_file, monkeypatch):
+    monkeypatch.setattr(config, "TRACE_TRUST_PARENT", True)
+
+    res = client.get(
+        "/api/status", headers={**user, "traceparent": traceparent(True)}
+    )
+
+    assert res.status_code == 200
+    spans = {span["name"]: span for span in read_spans(trace_file)}
+    root, upstream = spans["GET /api/status"], spans["upstream"]
+    assert {span["trace_id"] for span in spans.values()} == {TRACE_ID}
+    assert root["parent_id"] == PARENT_ID
+    assert root["attributes"]["http.status_code"] == 200
+    assert upstream["parent_id"] == root["span_id"]
+    assert all(
+        span["parent_id"] in (PARENT_ID, root["span_id"])
+        for span in spans.values()
+    )
+    # The API continues the trace as a child of the upstream span
+    sent = TRACEPARENT.match(res.json()["traceparent"])
+    assert (sent["trace_id"], sent["span_id"], sent["flags"]) == (
+        TRACE_ID,
+        upstream["span_id"],
+        "01",
+    )
+
+
+@pytest.mark.parametrize("api", [create_echo_api()])
+def test_untrusted_parent_is_sampled(client, user, trace_file):
+    res = client.get(
+        "/api/status", headers={**user, "traceparent": traceparent(True)}
+    )
+
+    assert read_spans(trace_file) == []
+    # The trace is still continued, unsampled
+    sent = TRACEPARENT.match(res.json()["traceparent"])
+    assert (sent["trace_id"], sent["flags"]) == (TRACE_ID, "00")
+
+
+@pytest.mark.parametrize("trust_parent", [True, False])
+def test_sample_rate_applies_to_parents(trust_parent):
+    tracer = Tracer(None, sample_rate=1.0, trust_parent=trust_parent)
+
+    span = tracer.start_trace("GET /", traceparent(False))
+
+    assert (span.trace_id, span.parent_id) == (TRACE_ID, PARENT_ID)
+    assert span.sampled is not trust_parent
@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import uuid
+
+DATA = bytes(range(256)) * 2000
+CHUNKS = [DATA[:200_000], DATA[200_000:400_000], DATA[400_000:]]
+
+
+def checksum(data: bytes, algorithm: str = "sha1") -> str:
+    digest = hashlib.new(algorithm, data).digest()
+    return f"{algorithm} {base64.b64encode(digest).decode('ascii')}"
+
+
+def upload(client, user, patch, chunk, offset, **headers):
+    return client.patch(
+        "/api/objects",
+        params={"patch": patch},
+        content=chunk,
+        headers={
+            **user,
+            "Upload-Offset": str(offset),
+            "Upload-Length": str(len(DATA)),
+            **headers,
+        },
+    )
+
+
+def test_digest_of_the_whole_upload(client, user):
+    patch, offset = str(uuid.uuid4()), 0
+    for chunk in CHUNKS:
+        res = upload(
+            client,
+            user,
+            patch,
+            chunk,
+            offset,
+            **{"Upload-Checksum": checksum(chunk)},
+        )
+        offset += len(chunk)
+        assert res.status_code == 204
+
+    assert res.headers["Upload-Digest"] == checksum(DATA, "sha256")
+
+
+def test_checksum_mismatch(client, user):
+    patch = str(uuid.uuid4())
+    res = upload(
+        client,
+        user,
+        patch,
+        CHUNKS[0],
+        0,
+        **{"Upload-Checksum": checksum(b"x")},
+    )
+
+    assert res.status_code == 460
+
+    # The rejected chunk is not part of the upload's digest
+    offset = 0
+    for chunk in CHUNKS:
+        res = upload(client, user, patch, chunk, offset)
+        offset += len(chunk)
+    assert res.headers["Upload-Digest"] == checksum(DATA, "sha256")
+
+
+def test_unsupported_checksum_algorithm(client, user):
+    res = upload(
+        client,
+        user,
+        str(uuid.uuid4()),
+        CHUNKS[0],
+        0,
+        **{"Upload-Checksum": "crc32 AAAA"},
+    )
+
+    assert res.status_code == 400
@@ -0,0 +1,28 @@
+from app.users import _encode_rows, _user_row
+import csv
+import io
+import orjson
+
+
+def test_csv_export_escapes_formulas():
+    users = [
+        {"id": "1", "username": '=HYPERLINK("http://x")', "lastName": "-"},
+        {"id": "2", "username": "@SUM(A1)", "firstName": "\tTab"},
+        {"id": "3", "username": "+1", "email": "a=b@example.org"},
+    ]
+    rows = [_user_row(user, admin=False, approved=True) for user in users]
+
+    data = _encode_rows(rows, "csv").decode("utf-8")
+
+    cells = [row[:4] for row in csv.reader(io.StringIO(data))]
+    assert cells == [
+        ['\'=HYPERLINK("http://x")', "", "'-", ""],
+        ["'@SUM(A1)", "'\tTab", "", ""],
+        ["'+1", "", "", "a=b@example.org"],
+    ]
+
+
+def test_ndjson_export_is_unchanged():
+    row = _user_row({"id": "1", "username": "=1"}, admin=True, approved=True)
+
+    assert orjson.loads(_encode_rows([row], "ndjson")) == row